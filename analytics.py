@@ -0,0 +1,137 @@
+import argparse
+from datetime import date as Date
+import numpy as np
+from db import Sqlite3DBHelper
+from schema import expense_tables
+from summary import lockdown, window_start
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+def load_columns() -> dict:
+    # all providers in one bulk read, plain tuples instead of sqlite3.Row
+    db = Sqlite3DBHelper()
+    db.connect()
+    tables = expense_tables(db.con)
+    providers = [provider for provider, table_name, columns in tables]
+    selects = []
+    for code, (provider, table_name, columns) in enumerate(tables):
+        # providers without restaurants are their own restaurant, as in daily_expense
+        restaurant = "restaurant_name" if "restaurant_name" in columns else "'{}'".format(provider.title())
+        selects.append(f"select cost, date, coalesce({restaurant}, 'NA'), {code} from {table_name}")
+    db.con.row_factory = None
+    cur = db.con.cursor()
+    rows = cur.execute(" union all ".join(selects)).fetchall() if selects else []
+    db.close()
+    if rows:
+        cost, date, restaurant, provider = zip(*rows)
+    else:
+        cost, date, restaurant, provider = (), (), (), ()
+    # restaurant names are dictionary encoded so grouping by restaurant is a bincount
+    restaurants, restaurant_codes = np.unique(np.array(restaurant, dtype=str), return_inverse=True)
+    return {
+        # paise and epoch seconds as stored, bincount sums of whole paise stay exact
+        "cost": np.array(cost, dtype=np.int64),
+        "date": np.array(date, dtype=np.int64).astype("datetime64[s]"),
+        "restaurant": restaurant_codes.astype(np.int32),
+        "restaurants": restaurants,
+        "provider": np.array(provider, dtype=np.int8),
+        "providers": np.array(providers, dtype=str),
+    }
+
+
+def save_npz(columns: dict, filename: str) -> None:
+    np.savez_compressed(filename, **columns)
+
+
+def load_npz(filename: str) -> dict:
+    with np.load(filename) as data:
+        return {k: data[k] for k in data.files}
+
+
+def save_parquet(columns: dict, filename: str) -> None:
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed, pip install pyarrow to export Parquet")
+    table = pa.table({
+        "cost": columns["cost"] / 100,
+        "date": columns["date"],
+        "restaurant_name": columns["restaurants"][columns["restaurant"]],
+        "provider": columns["providers"][columns["provider"]],
+    })
+    pq.write_table(table, filename)
+
+
+def summary(columns: dict, today: Date = None) -> dict:
+    # the same windows as summary.py
+    today = today or Date.today()
+    provider, cost, date = columns["provider"], columns["cost"], columns["date"]
+    n = len(columns["providers"])
+    start, end = (np.datetime64(t, "s") for t in lockdown)
+    windows = {
+        "lockdown_cost": (date >= start) & (date <= end),
+        "last_30_cost": date >= np.datetime64(window_start(today, 30), "s"),
+        "last_365_cost": date >= np.datetime64(window_start(today, 365), "s"),
+    }
+    totals = {
+        "total_orders": np.bincount(provider, minlength=n),
+        "total_cost": np.bincount(provider, weights=cost, minlength=n),
+    }
+    for name, mask in windows.items():
+        totals[name] = np.bincount(provider[mask], weights=cost[mask], minlength=n)
+    result = {}
+    for code, name in enumerate(columns["providers"]):
+        dates = date[provider == code]
+        result[str(name)] = {k: float(v[code]) / 100 for k, v in totals.items()}
+        result[str(name)]["total_orders"] = int(totals["total_orders"][code])
+        result[str(name)]["start_date"] = str(dates.min()) if len(dates) else None
+        result[str(name)]["end_date"] = str(dates.max()) if len(dates) else None
+    return result
+
+
+def monthly(columns: dict) -> tuple:
+    months = columns["date"].astype("datetime64[M]").astype(np.int64)
+    if not len(months):
+        return np.array([], dtype="datetime64[M]"), np.array([], dtype=np.int64), np.array([])
+    first = months.min()
+    orders = np.bincount(months - first)
+    cost = np.bincount(months - first, weights=columns["cost"]) / 100
+    labels = np.arange(first, first + len(orders)).astype("datetime64[M]")
+    present = orders > 0
+    return labels[present], orders[present], cost[present]
+
+
+def by_restaurant(columns: dict) -> tuple:
+    n = len(columns["restaurants"])
+    return (columns["restaurants"], np.bincount(columns["restaurant"], minlength=n),
+            np.bincount(columns["restaurant"], weights=columns["cost"], minlength=n) / 100)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Columnar export and vectorized analytics of food_expenses.db")
+    parser.add_argument("--npz", help="write the columns to a NumPy .npz file")
+    parser.add_argument("--parquet", help="write the columns to a Parquet file (needs pyarrow)")
+    parser.add_argument("--top", type=int, default=10, help="number of restaurants to show")
+    args = parser.parse_args()
+    columns = load_columns()
+    if args.npz:
+        save_npz(columns, args.npz)
+    if args.parquet:
+        save_parquet(columns, args.parquet)
+    for name, values in summary(columns).items():
+        print(f"{name.title()}: {values}")
+    print("\nMonthly expenses")
+    print("-"*20)
+    for month, orders, cost in zip(*monthly(columns)):
+        print(f"{month}: {orders} orders, Rs. {float(cost)}")
+    print("\nTop restaurants")
+    print("-"*20)
+    labels, orders, cost = by_restaurant(columns)
+    for i in np.argsort(cost)[::-1][:args.top]:
+        print(f"{labels[i]}: {orders[i]} orders, Rs. {float(cost[i])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import contextlib
+import multiprocessing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import UserSession
+from fetcher import FetchConfig, Fetcher
+from metrics import metrics
+from providers import providers
+from benchmarks.synthetic import generators
+from benchmarks.mock_server import MockProviderServer
+
+
+class BenchSession(UserSession):
+    # the mock server does not check credentials, so the session starts out logged in
+    def __init__(self, transport):
+        super().__init__(None, transport=transport)
+        self.sess = self.new_session()
+        self.headers["userid"] = "bench"
+        self.username = "bench"
+
+    def get_username(self):
+        return self.username
+
+    def logout(self):
+        pass
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def crawl(provider: str, base_url: str, workdir: str, orders: int, workers: int, batch_pages: int, stream: bool,
+          http2: bool) -> dict:
+    os.chdir(workdir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        calc = providers[provider].load()(offline=True, base_url=base_url, workers=workers, batch_pages=batch_pages,
+                                           stream=stream, http2=http2)
+        calc.user_session = BenchSession(calc.transport)
+        calc.headers = calc.user_session.headers
+        # pacing is not what is measured here, the limiter is opened up and failures are not retried
+        calc.fetcher = Fetcher(FetchConfig(start_rate=100000, max_rate=100000, retries=0), workers, name=provider)
+        start = time.perf_counter()
+        calc.crawl()
+        elapsed = time.perf_counter() - start
+    pages = metrics.calls("http_request_seconds", provider=provider)
+    return {
+        "benchmark": "crawl", "provider": provider, "orders": orders, "pages": pages,
+        "seconds": round(elapsed, 3), "pages_per_s": round(pages / elapsed, 1),
+        "orders_per_s": round(orders / elapsed, 1), "fetch_s": round(metrics.total("http_request_seconds"), 3),
+        "parse_s": round(metrics.total("parse_seconds"), 3), "db_write_s": round(metrics.total("db_write_seconds"), 3),
+        "db_commits": metrics.calls("db_write_seconds"),
+        "connections": int(metrics.total("http_connections_opened_total")), "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def build_db(workdir: str, orders: int, page_size: int, seed: int) -> list:
+    # fills one food_expenses.db through the regular parse_orders path, the same as reingest.py
+    os.chdir(workdir)
+    results = []
+    for name, generate in generators.items():
+        history = generate(orders, seed)
+        calc = providers[name].load()(offline=True, batch_pages=10)
+        start = time.perf_counter()
+        for i in range(0, len(history), page_size):
+            calc.parse_orders(calc.dump_page(history[i:i + page_size]))
+        calc.db.close()
+        elapsed = time.perf_counter() - start
+        results.append({
+            "benchmark": "ingest", "provider": name, "orders": orders, "seconds": round(elapsed, 3),
+            "orders_per_s": round(orders / elapsed, 1), "parse_s": round(metrics.total("parse_seconds", provider=name), 3),
+            "db_write_s": round(metrics.total("db_write_seconds", provider=name), 3),
+            "db_commits": metrics.calls("db_write_seconds", provider=name), "peak_rss_mb": peak_rss_mb(),
+        })
+    return results
+
+
+def time_summary(workdir: str, repeat: int) -> dict:
+    os.chdir(workdir)
+    import summary
+    times = {False: [], True: []}
+    # computed every time, then answered from the summary cache after the first run
+    for use_cache in (False, True):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                summary.do_calc(use_cache=use_cache)
+            times[use_cache].append(time.perf_counter() - start)
+    return {
+        "benchmark": "summary", "provider": "all", "db_mb": round(os.path.getsize("food_expenses.db") / 2**20, 1),
+        "repeat": repeat, "best_s": round(min(times[False]), 4), "mean_s": round(sum(times[False]) / repeat, 4),
+        "cached_s": round(min(times[True]), 5), "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_isolated(fn, *args):
+    # every benchmark gets a fresh interpreter so peak RSS is its own
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def show(result: dict) -> None:
+    name = "{:<8}{:<9}".format(result["benchmark"], result["provider"])
+    print(name + "  ".join("{}={}".format(k, v) for k, v in result.items() if k not in ("benchmark", "provider")))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline crawl, ingest and summary benchmarks against a local mock of the provider APIs.")
+    parser.add_argument("providers", nargs="*", help="providers to crawl ({}), all by default".format(", ".join(generators)))
+    parser.add_argument("--orders", type=int, default=2000, help="orders in each synthetic crawl history")
+    parser.add_argument("--page-size", type=int, default=10, help="orders per page served by the mock server")
+    parser.add_argument("--latency", type=float, default=0, help="seconds the mock server waits before every reply")
+    parser.add_argument("--workers", type=int, default=4, help="pages fetched concurrently, where the provider allows it")
+    parser.add_argument("--batch-pages", type=int, default=1, help="pages written per DB transaction")
+    parser.add_argument("--stream", action="store_true", help="decode pages while they download (needs ijson)")
+    parser.add_argument("--gzip", action="store_true", help="the mock server gzips pages for clients that accept it")
+    parser.add_argument("--http2", action="store_true", help="pass --http2 to the calculators (the mock server speaks HTTP/1.1)")
+    parser.add_argument("--db-orders", type=int, default=50000, help="orders per provider in the summary database")
+    parser.add_argument("--repeat", type=int, default=5, help="summary.do_calc runs to time")
+    parser.add_argument("--only", choices=["crawl", "summary"], help="run just one group of benchmarks")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory with the generated databases")
+    args = parser.parse_args()
+    for name in args.providers:
+        if name not in generators:
+            parser.error(f"unknown provider {name}")
+    workdir = tempfile.mkdtemp(prefix="food_expense_bench_")
+    results = []
+    try:
+        if args.only != "summary":
+            selected = args.providers or list(generators)
+            history = {name: generators[name](args.orders, args.seed) for name in selected}
+            server = MockProviderServer(history, args.page_size, args.latency, compress=args.gzip).start()
+            try:
+                for name in selected:
+                    crawl_dir = os.path.join(workdir, "crawl_" + name)
+                    os.mkdir(crawl_dir)
+                    workers = min(args.workers, providers[name].workers)
+                    results.append(run_isolated(crawl, name, server.url, crawl_dir, args.orders, workers, args.batch_pages,
+                                                args.stream, args.http2))
+                    show(results[-1])
+            finally:
+                server.stop()
+        if args.only != "crawl":
+            summary_dir = os.path.join(workdir, "summary")
+            os.mkdir(summary_dir)
+            for result in run_isolated(build_db, summary_dir, args.db_orders, 100, args.seed):
+                results.append(result)
+                show(result)
+            results.append(run_isolated(time_summary, summary_dir, args.repeat))
+            show(results[-1])
+    finally:
+        if args.keep:
+            print(f"Working directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import gzip
+import json
+import hashlib
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in one write, keep-alive clients would otherwise wait on delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        route = server.routes.get(url.path)
+        body = route(query) if route else None
+        with server.lock:
+            server.requests += 1
+        if body is None:
+            self.reply(404, {"error": "not found"})
+        else:
+            self.reply(200, body)
+
+    def reply(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        # pages carry an ETag, an unchanged page asked for with it gets an empty 304
+        etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        if self.server.compress and "gzip" in self.headers.get("Accept-Encoding", ""):
+            data = gzip.compress(data, 1)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    # stands in for the three order history APIs, serving the given synthetic orders newest first
+    daemon_threads = True
+
+    def __init__(self, orders: dict, page_size: int = 10, latency: float = 0, port: int = 0, compress: bool = False):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.orders = orders
+        self.page_size = page_size
+        self.latency = latency
+        self.compress = compress
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.routes = {
+            "/dapi/order/all": self.swiggy_page,
+            "/webroutes/user/orders": self.zomato_page,
+            "/order-service/ve1/orders": self.dominos_page,
+        }
+        # swiggy pages by the id of the last order already seen
+        self.swiggy_index = {str(order["order_id"]): i for i, order in enumerate(orders.get("swiggy", []))}
+
+    @property
+    def url(self) -> str:
+        return "http://{}:{}".format(*self.server_address)
+
+    def start(self) -> "MockProviderServer":
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def swiggy_page(self, query: dict) -> dict:
+        orders = self.orders.get("swiggy", [])
+        cursor = query.get("order_id", "")
+        start = self.swiggy_index[cursor] + 1 if cursor else 0
+        return {"statusCode": 0, "csrfToken": "bench",
+                "data": {"total_orders": len(orders), "orders": orders[start:start + self.page_size]}}
+
+    def zomato_page(self, query: dict) -> dict:
+        orders = self.orders.get("zomato", [])
+        page = int(query.get("page", 1))
+        total_pages = max(1, -(-len(orders) // self.page_size))
+        start = (page - 1) * self.page_size
+        return {"sections": {"SECTION_USER_ORDER_HISTORY": {"totalPages": total_pages, "currentPage": page}},
+                "entities": {"ORDER": {str(order["orderId"]): order for order in orders[start:start + self.page_size]}}}
+
+    def dominos_page(self, query: dict) -> dict:
+        orders = self.orders.get("dominos", [])
+        page = int(query.get("pageNo", 1))
+        start = (page - 1) * self.page_size
+        body = {"orders": orders[start:start + self.page_size]}
+        if start + self.page_size < len(orders):
+            body["link"] = {"href": "order-service/ve1/orders?userid={}&pageNo={}".format(query.get("userid"), page + 1)}
+        return body
@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import datetime
+import tempfile
+import contextlib
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import parsing
+from schema import epoch, paise
+from order_dump import OrderDumpWriter, iter_orders
+from providers import providers
+from benchmarks.synthetic import generators
+
+
+# the per-order parsing done by parse_orders before parsing.py, kept here as the baseline
+# (rows carry the account column and the paise/epoch second storage added since)
+
+def legacy_swiggy_page(orders: list, provider: str = "swiggy", account: str = None) -> tuple:
+    arr, items, dates = [], [], []
+    for order in orders:
+        date = epoch(datetime.datetime.strptime(order["order_time"], "%Y-%m-%d %H:%M:%S"))
+        dates.append(date)
+        if "delivered" not in order["order_status"].lower():
+            order_id = order["order_id"]
+            order_status = order["order_status"]
+            post_status = order["post_status"]
+            msg = f"Skipping entry for orderid: {order_id}, order_status: {order_status}, post_status: {post_status}"
+            logging.info(msg)
+            continue
+        order_id = order["order_id"]
+        cost = paise(order["order_total_with_tip"])
+        restaurant_name = order.get("restaurant_name", "NA")
+        food_items = []
+        for item_no, order_items in enumerate(order["order_items"]):
+            food_items.append("{qty} x {name}".format(qty=order_items["quantity"], name=order_items["name"]))
+            price = order_items.get("total")
+            items.append((provider, order_id, item_no, order_items["name"], int(order_items["quantity"]),
+                          paise(price) if price is not None else None))
+        arr.append((order_id, cost, date, restaurant_name, ", ".join(food_items), order["post_status"], account))
+    return arr, items, dates
+
+
+def legacy_zomato_page(orders, provider: str = "zomato", account: str = None) -> tuple:
+    arr, items, dates = [], [], []
+    for value in orders:
+        date = epoch(datetime.datetime.strptime(value["orderDate"], "%B %d, %Y at %I:%M %p"))
+        dates.append(date)
+        if "delivered" not in value["deliveryDetails"]["deliveryLabel"].lower():
+            msg = "Skipping entry for orderid: {} with status: {} ".format(value["orderId"], value["deliveryDetails"]["deliveryLabel"])
+            logging.info(msg)
+            continue
+        order_id = value["orderId"]
+        cost = paise(value["totalCost"].replace('₹','').replace(',',''))
+        food_items = value["dishString"]
+        for item_no, (quantity, name) in enumerate(parsing.dish_pattern.findall(food_items)):
+            items.append((provider, order_id, item_no, name, int(quantity), None))
+        restaurant_name = value["resInfo"]["name"]
+        arr.append((order_id, cost, date, restaurant_name, food_items, account))
+    return arr, items, dates
+
+
+def legacy_dominos_page(orders: list, provider: str = "dominos", account: str = None) -> tuple:
+    arr, items, dates = [], [], []
+    for order in orders:
+        date = epoch(datetime.datetime.strptime(order["store"]["orderDate"] + " " + order["store"]["orderTime"], "%Y-%m-%d %H:%M:%S" ))
+        dates.append(date)
+        if "success" not in order["orderState"].lower():
+            order_id = order["orderId"]
+            msg = f"Skipping entry for orderid: {order_id}"
+            logging.info(msg)
+            continue
+        order_id = order["orderId"]
+        cost = paise(order["netPrice"])
+        food_items = []
+        for item_no, item in enumerate(order["items"]):
+            food_items.append("{qty} x {name}".format(qty=item["quantity"], name=item["product"]["name"]))
+            price = item.get("price")
+            items.append((provider, order_id, item_no, item["product"]["name"], int(item["quantity"]),
+                          paise(price) if price is not None else None))
+        arr.append((order_id, cost, date, ", ".join(food_items), account))
+    return arr, items, dates
+
+
+legacy = {"swiggy": legacy_swiggy_page, "zomato": legacy_zomato_page, "dominos": legacy_dominos_page}
+fast = {"swiggy": parsing.swiggy_page, "zomato": parsing.zomato_page, "dominos": parsing.dominos_page}
+
+
+def pages(filename: str, page_size: int):
+    page = []
+    for order in iter_orders(filename):
+        page.append(order)
+        if len(page) == page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def time_parse(parse, batches: list) -> tuple:
+    start = time.perf_counter()
+    output = [parse(page) for page in batches]
+    return time.perf_counter() - start, output
+
+
+@contextlib.contextmanager
+def page_parser(name: str, parse):
+    # the calculators look their page parser up on the parsing module at call time
+    attr = f"{name}_page"
+    original = getattr(parsing, attr)
+    setattr(parsing, attr, parse)
+    try:
+        yield
+    finally:
+        setattr(parsing, attr, original)
+
+
+def time_reingest(name: str, parse, filename: str, workdir: str, page_size: int) -> float:
+    os.makedirs(workdir)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with page_parser(name, parse):
+            calc = providers[name].load()(batch_pages=10, offline=True)
+            start = time.perf_counter()
+            calc.ingest_dump(filename, page_size)
+            return time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Parse and re-ingest speed of parsing.py against the old per-order path.")
+    parser.add_argument("providers", nargs="*", help="providers to measure ({}), all by default".format(", ".join(generators)))
+    parser.add_argument("--orders", type=int, default=100000, help="orders in each synthetic archive")
+    parser.add_argument("--page-size", type=int, default=1000, help="orders parsed per batch, as reingest.py --page-size")
+    parser.add_argument("--gzip", action="store_true", help="write the archives gzipped")
+    parser.add_argument("--no-reingest", action="store_true", help="only time parsing, skip the DB writes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    for name in args.providers:
+        if name not in generators:
+            parser.error(f"unknown provider {name}")
+    workdir = tempfile.mkdtemp(prefix="food_expense_parse_bench_")
+    try:
+        for name in args.providers or list(generators):
+            filename = os.path.join(workdir, "{}_data.jsonl{}".format(name, ".gz" if args.gzip else ""))
+            dump = OrderDumpWriter(filename, args.gzip)
+            dump.write(generators[name](args.orders, args.seed))
+            dump.close()
+            # JSON decoding is the same for both, the archive is read once and only parsing is timed
+            batches = list(pages(filename, args.page_size))
+            old_time, old_output = time_parse(legacy[name], batches)
+            new_time, new_output = time_parse(fast[name], batches)
+            del batches
+            if old_output != new_output:
+                raise SystemExit(f"{name}: parsing.py output differs from the per-order path")
+            print(f"{name} parse: per-order {args.orders / old_time:,.0f} orders/s, "
+                  f"parsing.py {args.orders / new_time:,.0f} orders/s, {old_time / new_time:.2f}x")
+            if not args.no_reingest:
+                old_time = time_reingest(name, legacy[name], filename, os.path.join(workdir, name + "_old"), args.page_size)
+                new_time = time_reingest(name, fast[name], filename, os.path.join(workdir, name + "_new"), args.page_size)
+                print(f"{name} reingest: per-order {args.orders / old_time:,.0f} orders/s, "
+                      f"parsing.py {args.orders / new_time:,.0f} orders/s, {old_time / new_time:.2f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import random
+from datetime import datetime, timedelta
+
+
+restaurants = ["Meghana Foods", "Empire Restaurant", "Truffles", "Corner House", "Nandhini Deluxe",
+               "Vidyarthi Bhavan", "Leon Grill", "Chinita", "Burma Burma", "Paradise Biryani"]
+dishes = ["Chicken Biryani", "Paneer Butter Masala", "Masala Dosa", "Veg Fried Rice", "Butter Naan",
+          "Chilli Chicken", "Gobi Manchurian", "Filter Coffee", "Chocolate Brownie", "Mutton Rogan Josh",
+          "Margherita", "Farmhouse", "Peppy Paneer", "Garlic Breadsticks", "Choco Lava Cake"]
+
+
+def order_times(count: int, seed: int = 1, end: datetime = None) -> list:
+    # newest first, a few hours to a few days apart, the way the order history APIs list them
+    rnd = random.Random(seed)
+    when = (end or datetime.now()).replace(microsecond=0)
+    times = []
+    for _ in range(count):
+        when -= timedelta(seconds=rnd.randint(3600, 4 * 86400))
+        times.append(when)
+    return times
+
+
+def order_lines(rnd: random.Random) -> list:
+    return [(rnd.randint(1, 3), rnd.choice(dishes), round(rnd.uniform(80, 450), 2)) for _ in range(rnd.randint(1, 4))]
+
+
+def swiggy_orders(count: int, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    orders = []
+    for i, when in enumerate(order_times(count, seed)):
+        lines = order_lines(rnd)
+        orders.append({
+            "order_id": 90000000000 - i,
+            "order_time": when.strftime("%Y-%m-%d %H:%M:%S"),
+            "order_status": "Delivered" if rnd.random() > 0.03 else "Cancelled",
+            "post_status": "",
+            "order_total_with_tip": str(round(sum(q * p for q, _, p in lines) + rnd.uniform(0, 60), 2)),
+            "restaurant_name": rnd.choice(restaurants),
+            "order_items": [{"name": name, "quantity": str(q), "total": str(round(q * p, 2))} for q, name, p in lines],
+        })
+    return orders
+
+
+def zomato_orders(count: int, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    orders = []
+    for i, when in enumerate(order_times(count, seed)):
+        lines = order_lines(rnd)
+        cost = sum(q * p for q, _, p in lines) + rnd.uniform(0, 60)
+        orders.append({
+            "orderId": 2000000000 - i,
+            "orderDate": when.strftime("%B %d, %Y at %I:%M %p"),
+            "deliveryDetails": {"deliveryLabel": "Delivered" if rnd.random() > 0.03 else "Order Cancelled"},
+            "totalCost": "₹{:,.2f}".format(cost),
+            "dishString": ", ".join("{} x {}".format(q, name) for q, name, _ in lines),
+            "resInfo": {"name": rnd.choice(restaurants)},
+        })
+    return orders
+
+
+def dominos_orders(count: int, seed: int = 1) -> list:
+    rnd = random.Random(seed)
+    orders = []
+    for i, when in enumerate(order_times(count, seed)):
+        lines = order_lines(rnd)
+        orders.append({
+            "orderId": "DPI{}".format(700000000 - i),
+            "store": {"orderDate": when.strftime("%Y-%m-%d"), "orderTime": when.strftime("%H:%M:%S")},
+            "orderState": "SUCCESS" if rnd.random() > 0.03 else "CANCELLED",
+            "netPrice": round(sum(q * p for q, _, p in lines), 2),
+            "items": [{"quantity": q, "product": {"name": name}, "price": round(q * p, 2)} for q, name, p in lines],
+        })
+    return orders
+
+
+generators = {
+    "swiggy": swiggy_orders,
+    "zomato": zomato_orders,
+    "dominos": dominos_orders,
+}
@@ -1,56 +1,300 @@
+import re
 import sqlite3
+import argparse
+import logging
+import datetime
 from abc import ABC, abstractmethod
+import requests
 from requests import Response
-
-class Sqlite3DBHelper():
-    def __init__(self):
-        self.dbfile = "food_expenses.db"
-        self.con = None
-        self.cur = None
-    
-    def connect(self) -> None:
-        self.con = sqlite3.connect(self.dbfile)
-        self.con.row_factory = sqlite3.Row
-
-    def get_cursor(self) -> None:
-        if not self.con:
-            self.connect()
-        if not self.cur:
-            self.cur = self.con.cursor()
-        return self.cur
-        
-    def commit(self) -> None:
-        self.con.commit()
-    
-    def close(self) -> None:
-        self.con.close()
+from order_dump import OrderDumpWriter, iter_orders
+from session_store import SessionStore
+from fetcher import FetchConfig, Fetcher, fetch_configs
+from transport import Transport
+from page_cache import PageCache, ProviderPages, add_page_cache_arguments, page_cache_from_args
+from json_stream import OrderStream
+from metrics import metrics, add_metrics_arguments
+from schema import default_account, from_epoch, rollup_select, rollup_triggers, bump_counter, daily_expense_table
+# re-exported, the DB helper lives in db.py so reports can use it without the HTTP stack
+from db import Sqlite3DBHelper
 
 
 class ExpenseCalc(ABC):
-    sleep_dur = [3, 4, 5]
+    provider = None
+    table_name = None
+    base_url = None
+    # orders handed to parse_orders at a time while a page is streamed
+    stream_chunk = 50
+
+    def __init__(self, incremental: bool = False, batch_pages: int = 1, batch_rows: int = None,
+                 compress_dump: bool = False, workers: int = 1, rate: float = None, base_url: str = None,
+                 stream: bool = False, account: str = None, profile: str = None, http2: bool = False,
+                 page_cache: PageCache = None):
+        self.incremental = incremental
+        # account is the provider's id for the logged in user, rows are partitioned by it.
+        # profile is a local name for one of several logins, it keeps their saved sessions apart
+        self.account = account or default_account
+        self.profile = profile
+        # order history requests go to base_url, the benchmarks point it at a local mock server
+        self.base_url = base_url or self.base_url
+        self.high_water_mark = None
+        self.compress_dump = compress_dump
+        self.stream = stream
+        # recorded pages are kept per profile, the same name picks them again for a replay
+        self.pages = page_cache.scope(self.provider, profile) if page_cache else None
+        if self.pages and stream:
+            logging.info("Pages are read whole while the page cache is on, --stream is ignored")
+            self.stream = False
+        self.dump = None
+        # pages fetched at a time, only used by providers whose pagination allows it
+        self.workers = workers
+        self.fetcher = Fetcher(fetch_configs.get(self.provider, FetchConfig()), workers, rate, self.provider)
+        # the login and every page of it share one pool of keep-alive connections, one per worker
+        self.transport = Transport(workers, http2, self.provider)
+        self.db = Sqlite3DBHelper(batch_pages, batch_rows, self.provider)
 
     @abstractmethod
     def get_details(self) -> None:
         pass
 
+    def crawl(self) -> None:
+        with metrics.timer("crawl_seconds", provider=self.provider):
+            self.get_details()
+        self.transport.record()
+        if self.pages and not self.pages.replaying:
+            self.pages.cache.evict()
+
     @abstractmethod
-    def parse_orders(self, orders: object) -> None:
+    def parse_orders(self, orders: object, page_done: bool = True) -> int:
         pass
 
+    def get_page(self, sess, url: str, retries: int = None) -> Response:
+        return self.fetcher.get(sess, url, self.headers, retries, self.stream, self.pages)
+
+    def page_orders(self, response: Response, path: str, fields: list = ()) -> OrderStream:
+        return OrderStream(response, path, fields, self.stream)
+
+    def parse_stream(self, page: OrderStream) -> int:
+        metrics.count("pages_total", provider=self.provider)
+        with metrics.timer("page_seconds", provider=self.provider):
+            if not page.streaming:
+                with metrics.timer("json_decode_seconds", provider=self.provider):
+                    orders = list(page)
+                return self.parse_orders(self.dump_page(orders))
+            # a streamed page is parsed in chunks as it arrives, all chunks of a page count as one page for batching
+            new_orders = 0
+            chunk = []
+            for order in page:
+                chunk.append(order)
+                if len(chunk) == self.stream_chunk:
+                    new_orders += self.parse_orders(self.dump_page(chunk), page_done=False)
+                    chunk = []
+            return new_orders + self.parse_orders(self.dump_page(chunk))
+
+    def parse_page(self, parse, orders) -> tuple:
+        with metrics.timer("parse_seconds", provider=self.provider):
+            arr, items, dates = parse(orders, self.provider, self.account)
+        metrics.count("orders_total", len(dates), provider=self.provider)
+        metrics.count("orders_skipped_total", len(dates) - len(arr), provider=self.provider)
+        return arr, items, dates
+
     def db_setup(self, sql_stmt) -> None:
-        db = Sqlite3DBHelper()
-        cur = db.get_cursor()
-        cur.execute(sql_stmt)
-        db.commit()
-        db.close()
+        self.db.execute(sql_stmt)
+        self.db.commit()
+
+    def set_account(self, account: str) -> None:
+        if account:
+            self.account = str(account)
+            if self.pages and not self.pages.replaying:
+                self.pages.save_account(self.account)
+            logging.info("{} account {}".format(self.provider.title(), self.account))
+
+    # summaries and the high-water mark read an account's orders straight from this index
+    def account_setup(self) -> None:
+        self.db_setup(f"CREATE INDEX IF NOT EXISTS {self.table_name}_account_date ON {self.table_name}(account, date, cost);")
+
+    def insert_stmt(self, columns: list) -> str:
+        # an order stored under the default account moves to the account whose history lists it
+        return (f"INSERT INTO {self.table_name}({', '.join(columns)}, account) "
+                f"VALUES ({', '.join('?' * (len(columns) + 1))}) ON CONFLICT(order_id) DO UPDATE SET "
+                f"account = excluded.account WHERE account = '{default_account}' AND excluded.account <> '{default_account}'")
+
+    # daily_expense holds per day/restaurant totals, triggers keep it in step with every insert
+    # and delete done by parse_orders so reports never have to rescan the raw rows
+    def rollup_setup(self, has_restaurant: bool = True) -> None:
+        # two crawls or re-ingests of the provider may start together, the check and the creation
+        # are one transaction so only the first creates the triggers
+        with self.db.immediate() as cur:
+            cur.execute(daily_expense_table)
+            cur.execute("select name FROM sqlite_master WHERE type='trigger' AND name=?", (self.table_name + "_rollup_update",))
+            if cur.fetchone():
+                return
+            for sql_stmt in rollup_triggers(self.provider, self.table_name, has_restaurant):
+                cur.execute(sql_stmt)
+            # rows stored before the triggers existed
+            cur.execute("DELETE FROM daily_expense WHERE provider = ?", (self.provider,))
+            cur.execute(
+                "INSERT INTO daily_expense(provider, account, day, restaurant_name, order_count, total_cost) "
+                + rollup_select(self.provider, self.table_name, has_restaurant))
+            cur.execute(bump_counter(self.provider))
+
+    # one row per dish so dish level questions are index lookups instead of LIKE scans on food_items
+    def items_setup(self) -> None:
+        self.db_setup(
+            "CREATE TABLE IF NOT EXISTS order_items(provider TEXT, order_id TEXT, item_no INTEGER, "
+            "name TEXT, quantity INTEGER, price INTEGER, UNIQUE(provider, order_id, item_no));"
+        )
+        self.db_setup("CREATE INDEX IF NOT EXISTS order_items_name ON order_items(name COLLATE NOCASE);")
+        self.db_setup("CREATE INDEX IF NOT EXISTS order_items_order_id ON order_items(order_id);")
+        self.db_setup(
+            f"CREATE TRIGGER IF NOT EXISTS {self.table_name}_items_delete AFTER DELETE ON {self.table_name} BEGIN "
+            f"DELETE FROM order_items WHERE provider = '{self.provider}' AND order_id = old.order_id; END;"
+        )
+        # the triggers go missing when a schema upgrade rebuilds order_items, the index itself is kept
+        cur = self.db.execute("select name FROM sqlite_master WHERE name='order_items_fts_insert'")
+        if cur.fetchone():
+            return
+        try:
+            self.db_setup("CREATE VIRTUAL TABLE IF NOT EXISTS order_items_fts USING fts5(name, content='order_items', content_rowid='rowid');")
+        except sqlite3.OperationalError:
+            logging.info("SQLite has no FTS5, dish search will use LIKE")
+            return
+        self.db_setup(
+            "CREATE TRIGGER IF NOT EXISTS order_items_fts_insert AFTER INSERT ON order_items BEGIN "
+            "INSERT INTO order_items_fts(rowid, name) VALUES (new.rowid, new.name); END;"
+        )
+        self.db_setup(
+            "CREATE TRIGGER IF NOT EXISTS order_items_fts_delete AFTER DELETE ON order_items BEGIN "
+            "INSERT INTO order_items_fts(order_items_fts, rowid, name) VALUES ('delete', old.rowid, old.name); END;"
+        )
+        self.db_setup("INSERT INTO order_items_fts(order_items_fts) VALUES ('rebuild');")
+
+    def insert_items(self, items: list) -> None:
+        sql_stmt = ("INSERT OR IGNORE INTO "
+            "order_items(provider, order_id, item_no, name, quantity, price) VALUES (?, ?, ?, ?, ?, ?)")
+        self.db.executemany(sql_stmt, items)
+
+    # newest stored order for this provider, orders at or below it are already in the DB
+    def load_high_water_mark(self) -> None:
+        cur = self.db.get_cursor()
+        cur.execute(f"select order_id, date from {self.table_name} where account = ? order by date desc limit 1", (self.account,))
+        r = cur.fetchone()
+        self.high_water_mark = dict(r) if r else None
+        if self.high_water_mark:
+            logging.info("High-water mark for {} {}: {}".format(
+                self.provider, self.account, from_epoch(self.high_water_mark["date"]).isoformat()))
+
+    # crawl progress is saved after every page so a failed run can resume where it stopped,
+    # it is written in the same transaction as the rows of the following pages
+    def load_checkpoint(self) -> dict:
+        self.db_setup(
+            "CREATE TABLE IF NOT EXISTS crawl_state(provider TEXT, account TEXT, cursor TEXT, pages_done INTEGER, "
+            "payload TEXT, updated TEXT, PRIMARY KEY(provider, account));"
+        )
+        cur = self.db.get_cursor()
+        cur.execute("select cursor, pages_done, payload from crawl_state where provider = ? and account = ?",
+                    (self.provider, self.account))
+        r = cur.fetchone()
+        return dict(r) if r else None
+
+    def save_checkpoint(self, cursor: str, pages_done: int, payload: str) -> None:
+        self.db.executemany(
+            "INSERT OR REPLACE INTO crawl_state(provider, account, cursor, pages_done, payload, updated) VALUES (?, ?, ?, ?, ?, ?)",
+            [(self.provider, self.account, cursor, pages_done, payload, datetime.datetime.now().isoformat())])
+
+    def clear_checkpoint(self) -> None:
+        self.db.execute("DELETE FROM crawl_state where provider = ? and account = ?", (self.provider, self.account))
+        self.db.commit()
+
+    # raw orders are appended to a JSON Lines file page by page instead of being kept in memory
+    def open_dump(self, append: bool = False) -> None:
+        self.dump = OrderDumpWriter(dump_name(self.provider, self.account), self.compress_dump, append)
+
+    def dump_orders(self, orders, dates: list) -> None:
+        # an incremental run leaves out the orders at or below the high-water mark, the dump already has them
+        if self.dump:
+            if self.high_water_mark is not None:
+                orders = [order for order, date in zip(orders, dates) if not self.is_known(date)]
+            with metrics.timer("dump_write_seconds", provider=self.provider):
+                self.dump.write(orders)
+
+    def close_dump(self) -> None:
+        if self.dump:
+            self.dump.close()
+            self.dump = None
+
+    # parse_orders expects a page in the shape the provider API returns it
+    def dump_page(self, orders: list) -> object:
+        return orders
+
+    def ingest_dump(self, filename: str, page_size: int = 1000) -> int:
+        count = 0
+        page = []
+        for order in iter_orders(filename):
+            page.append(order)
+            if len(page) == page_size:
+                self.parse_orders(self.dump_page(page))
+                count += len(page)
+                page = []
+        if page:
+            self.parse_orders(self.dump_page(page))
+            count += len(page)
+        self.db.close()
+        return count
+
+    def is_known(self, date: int) -> bool:
+        return self.high_water_mark is not None and date <= self.high_water_mark["date"]
+
+    def count_new(self, dates: list) -> int:
+        if self.high_water_mark is None:
+            return len(dates)
+        return sum(1 for date in dates if not self.is_known(date))
+
+
+def dump_name(provider: str, account: str = default_account) -> str:
+    # the default account keeps the file name used before accounts were tracked
+    if account == default_account:
+        return "{}_data.jsonl".format(provider)
+    return "{}_{}_data.jsonl".format(provider, re.sub(r"[^\w.@-]", "_", account))
+
+
+def add_crawl_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--incremental", action="store_true", help="stop once already stored orders are reached")
+    parser.add_argument("--batch-pages", type=int, default=1, help="pages written per DB transaction")
+    parser.add_argument("--batch-rows", type=int, help="rows written per DB transaction")
+    parser.add_argument("--gzip", action="store_true", help="gzip the raw orders dump")
+    parser.add_argument("--stream", action="store_true",
+                        help="decode pages while they download instead of all at once (needs ijson)")
+    parser.add_argument("--rate", type=float, help="cap on requests per second to the provider, pacing adapts below it")
+    parser.add_argument("--account", action="append", dest="profiles", metavar="NAME",
+                        help="crawl one more account, NAME keeps its saved session apart, can be repeated")
+    parser.add_argument("--http2", action="store_true", help="use HTTP/2 where the provider offers it (needs httpx[http2])")
+    parser.add_argument("--session-cache", action="store_true",
+                        help="reuse the logged in session saved by an earlier run (encrypted in sessions.enc)")
+    add_page_cache_arguments(parser)
+    add_metrics_arguments(parser)
+
+
+def crawl_options(args: argparse.Namespace) -> dict:
+    return {"incremental": args.incremental, "batch_pages": args.batch_pages, "batch_rows": args.batch_rows,
+            "compress_dump": args.gzip, "rate": args.rate, "stream": args.stream, "http2": args.http2,
+            "session_store": SessionStore() if args.session_cache else None,
+            "page_cache": page_cache_from_args(args)}
 
 
 class UserSession():
+    provider = None
+    # attributes besides headers and cookies that make up a logged in session
+    state_attrs = []
 
-    def __init__(self, filename: str):
+    def __init__(self, filename: str, profile: str = None, transport: Transport = None):
         self.headers = {}
         self.creds = {}
         self.filename = filename
+        self.store = None
+        self.replaying = False
+        self.transport = transport or Transport(name=self.provider)
+        # sessions of the same provider are saved under provider:profile
+        self.store_key = "{}:{}".format(self.provider, profile) if profile else self.provider
 
     def set_default_headers(self):
         with open(self.filename, "r") as f:
@@ -80,4 +324,75 @@ class UserSession():
             print(reply.text)
 
     def get_session(self):
-        return self.sess
\ No newline at end of file
+        return self.sess
+
+    def new_session(self) -> requests.Session:
+        return self.transport.session()
+
+    def validate(self) -> bool:
+        return False
+
+    def get_account(self) -> str:
+        # the provider's id for the logged in user
+        return None
+
+    def export_state(self) -> dict:
+        cookies = [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+                    "expires": c.expires, "secure": c.secure} for c in self.sess.cookies]
+        return {"headers": self.headers, "cookies": cookies, "attrs": {k: getattr(self, k) for k in self.state_attrs}}
+
+    def import_state(self, state: dict) -> None:
+        self.sess = self.new_session()
+        for cookie in state["cookies"]:
+            self.sess.cookies.set(**cookie)
+        self.headers.clear()
+        self.headers.update(state["headers"])
+        for k, v in state["attrs"].items():
+            setattr(self, k, v)
+
+    def restore_account(self, account: str) -> None:
+        # sets whatever the order history requests need of the account id, for a replay
+        pass
+
+    def replay(self, account: str) -> dict:
+        # stands in for a login when the order pages come from the page cache, nothing is sent
+        self.replaying = True
+        self.sess = self.new_session()
+        self.headers.clear()
+        self.set_default_headers()
+        self.restore_account(account)
+        logging.info("Replaying recorded {} pages of {}...".format(self.provider, account))
+        return self.headers
+
+    def login(self, store=None, pages: ProviderPages = None) -> dict:
+        if pages and pages.replaying:
+            return self.replay(pages.account())
+        self.store = store
+        if store:
+            state = store.get(self.store_key)
+            if state:
+                self.import_state(state)
+                try:
+                    with metrics.timer("session_validate_seconds", provider=self.provider):
+                        valid = self.validate()
+                except (ValueError, requests.RequestException):
+                    valid = False
+                if valid:
+                    logging.info("Reusing saved {} session...".format(self.store_key))
+                    return self.headers
+                logging.info("Saved {} session expired, logging in again...".format(self.store_key))
+                store.clear(self.store_key)
+        with metrics.timer("auth_seconds", provider=self.provider):
+            headers = self.doauth()
+        if store:
+            store.save(self.store_key, self.export_state())
+        return headers
+
+    def finish(self) -> None:
+        # a cached session is kept alive for the next run instead of logging out
+        if self.replaying:
+            return
+        if self.store:
+            self.store.save(self.store_key, self.export_state())
+        else:
+            self.logout()
\ No newline at end of file
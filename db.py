@@ -0,0 +1,157 @@
+import json
+import time
+import random
+import logging
+import sqlite3
+from contextlib import contextmanager
+from metrics import metrics
+from schema import migrate
+
+
+class Sqlite3DBHelper():
+    def __init__(self, batch_pages: int = 1, batch_rows: int = None, name: str = None):
+        self.dbfile = "food_expenses.db"
+        # provider label of the metrics
+        self.name = name
+        self.con = None
+        self.cur = None
+        # a transaction is committed after batch_pages pages or batch_rows rows, whichever comes first
+        self.batch_pages = batch_pages
+        self.batch_rows = batch_rows
+        self.pending = []
+        self.pending_pages = 0
+        self.pending_rows = 0
+        # other crawler processes may hold the write lock, wait for it and then back off and retry
+        self.busy_timeout = 10
+        self.busy_retries = 5
+    
+    def connect(self) -> None:
+        # a calc may be set up on one thread and crawl on another, it is never used by two at once
+        self.con = sqlite3.connect(self.dbfile, timeout=self.busy_timeout, check_same_thread=False)
+        self.con.row_factory = sqlite3.Row
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("PRAGMA cache_size=-16000")
+        migrate(self.con)
+
+    def get_cursor(self) -> None:
+        if not self.con:
+            self.connect()
+        if not self.cur:
+            self.cur = self.con.cursor()
+        return self.cur
+
+    def retry_busy(self, fn, *args):
+        delay = 0.1
+        for attempt in range(self.busy_retries):
+            try:
+                return fn(*args)
+            except sqlite3.OperationalError as e:
+                if ("locked" not in str(e) and "busy" not in str(e)) or attempt == self.busy_retries - 1:
+                    raise
+                logging.warning("Database busy, retrying in {:.2f}s".format(delay))
+                time.sleep(delay + random.uniform(0, delay))
+                delay *= 2
+
+    def execute(self, sql_stmt: str, params: tuple = ()) -> sqlite3.Cursor:
+        if self.pending:
+            self.commit()
+        return self.retry_busy(self.get_cursor().execute, sql_stmt, params)
+
+    def executemany(self, sql_stmt: str, rows: list) -> None:
+        # writes are buffered so the write lock is only held while a batch is flushed
+        self.pending.append((sql_stmt, rows))
+        self.pending_rows += len(rows)
+
+    def page_done(self) -> None:
+        self.pending_pages += 1
+        if self.pending_pages >= self.batch_pages or (self.batch_rows and self.pending_rows >= self.batch_rows):
+            self.commit()
+
+    def write_pending(self) -> None:
+        cur = self.get_cursor()
+        try:
+            with metrics.timer("db_write_seconds", provider=self.name):
+                for sql_stmt, rows in self.pending:
+                    cur.executemany(sql_stmt, rows)
+                self.con.commit()
+        except sqlite3.OperationalError:
+            self.con.rollback()
+            raise
+        metrics.count("db_commits_total", provider=self.name)
+        metrics.count("db_rows_written_total", self.pending_rows, provider=self.name)
+        
+    def commit(self) -> None:
+        if self.pending:
+            self.retry_busy(self.write_pending)
+        elif self.con:
+            self.retry_busy(self.con.commit)
+        self.pending = []
+        self.pending_pages = 0
+        self.pending_rows = 0
+    
+    @contextmanager
+    def immediate(self):
+        # one write transaction that takes the lock up front, for setup steps another process may be doing
+        # at the same time: the second one waits and then sees what the first created
+        self.commit()
+        cur = self.get_cursor()
+        self.retry_busy(cur.execute, "BEGIN IMMEDIATE")
+        try:
+            yield cur
+            self.con.commit()
+        except Exception:
+            self.con.rollback()
+            raise
+
+    def close(self) -> None:
+        self.commit()
+        if self.con:
+            self.con.close()
+        self.con = None
+        self.cur = None
+
+
+class SummaryCache():
+    # computed report results kept next to the data. A result stays valid while the write counters of the
+    # providers it was computed from are unchanged, the rollup triggers bump them on every change to their rows
+    max_age = 30 * 86400
+
+    def __init__(self, db: Sqlite3DBHelper):
+        self.db = db
+
+    def versions(self, providers: list) -> str:
+        cur = self.db.get_cursor()
+        cur.execute("select provider, version from write_counter where provider in ({})".format(", ".join("?" * len(providers))),
+                    list(providers))
+        counters = {r["provider"]: r["version"] for r in cur.fetchall()}
+        return ",".join("{}={}".format(provider, counters.get(provider, 0)) for provider in sorted(providers))
+
+    def get(self, key: str, version: str):
+        cur = self.db.get_cursor()
+        cur.execute("select result from summary_cache where key = ? and version = ?", (key, version))
+        r = cur.fetchone()
+        return json.loads(r["result"]) if r else None
+
+    def put(self, key: str, version: str, result) -> None:
+        now = int(time.time())
+        try:
+            self.db.con.execute("INSERT OR REPLACE INTO summary_cache(key, version, result, created) VALUES (?, ?, ?, ?)",
+                                (key, version, json.dumps(result), now))
+            self.db.con.execute("DELETE FROM summary_cache WHERE created < ?", (now - self.max_age,))
+            self.db.con.commit()
+        except sqlite3.OperationalError as e:
+            # a report is still answered when a crawl holds the write lock, it is just not cached
+            self.db.con.rollback()
+            logging.info("Summary not cached: {}".format(e))
+
+    def cached(self, key: str, providers: list, compute):
+        version = self.versions(providers)
+        result = self.get(key, version)
+        if result is None:
+            metrics.count("summary_cache_misses_total")
+            result = compute()
+            self.put(key, version, result)
+        else:
+            metrics.count("summary_cache_hits_total")
+        return result
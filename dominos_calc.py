@@ -1,15 +1,18 @@
-import json
+import argparse
 import logging
-import requests
-import datetime
-import time
 import random
-from common import ExpenseCalc, Sqlite3DBHelper, UserSession
+import parsing
+from common import ExpenseCalc, UserSession, add_crawl_arguments, crawl_options
+from session_store import SessionStore
+from transport import Transport
+from metrics import instrumented
 
 
 class DominosUserSession(UserSession):
-    def __init__(self, filename: str):
-        super().__init__(filename)
+    provider = "dominos"
+
+    def __init__(self, filename: str, profile: str = None, transport: Transport = None):
+        super().__init__(filename, profile, transport)
 
     def set_cred(self, reply):
         for k,v in reply.json().get("credentials").items():
@@ -28,10 +31,10 @@ class DominosUserSession(UserSession):
     def doauth(self) -> dict:        
         self.payload = {}
         self.build_header()
-        reply = requests.post("https://api.dominos.co.in/loginhandler/anonymoususer", data=self.payload, headers=self.headers)   
+        self.sess = self.new_session()
+        reply = self.sess.post("https://api.dominos.co.in/loginhandler/anonymoususer", data=self.payload, headers=self.headers)
         self.has_failed(reply)
         self.set_cred(reply)
-        self.sess = requests.Session()
         while True:
             mob_num = input("Enter Mobile Number: ")
             ch = input("Continue Y/y or N/n ? ")
@@ -59,6 +62,16 @@ class DominosUserSession(UserSession):
         logging.info("login successful...")
         return self.headers
     
+    def get_account(self) -> str:
+        return self.headers.get("userid")
+
+    def restore_account(self, account: str) -> None:
+        self.headers["userid"] = account
+
+    def validate(self) -> bool:
+        reply = self.sess.get("https://api.dominos.co.in/order-service/ve1/orders?userid={}".format(self.headers["userid"]), headers=self.headers)
+        return reply.status_code == 200
+
     def logout(self):
         reply = self.sess.post("https://api.dominos.co.in/loginhandler/anonymoususer", headers=self.headers)
         if reply.status_code != 200:
@@ -68,67 +81,78 @@ class DominosUserSession(UserSession):
 
 
 class DominosCalc(ExpenseCalc):
-    def __init__(self):
-        self.json_arr = []
-        self.user_session = DominosUserSession("dominos_header")
-        self.headers = self.user_session.doauth()
-        self.url = "https://api.dominos.co.in/{}"
+    provider = "dominos"
+    table_name = "dominos_expense"
+    base_url = "https://api.dominos.co.in"
+
+    def __init__(self, offline: bool = False, session_store: SessionStore = None, **kwargs):
+        super().__init__(**kwargs)
+        if not offline:
+            self.user_session = DominosUserSession("dominos_header", self.profile, self.transport)
+            self.headers = self.user_session.login(session_store, self.pages)
+            self.set_account(self.user_session.get_account())
+        self.url = self.base_url + "/{}"
         self.total_orders = 0
         
         sql_stmt = (
             "CREATE TABLE IF NOT EXISTS "
-            "dominos_expense(order_id TEXT UNIQUE, cost REAL, date TEXT, food_items TEXT)")
+            "dominos_expense(order_id TEXT PRIMARY KEY, cost INTEGER, date INTEGER, food_items TEXT, "
+            "account TEXT NOT NULL DEFAULT 'default') WITHOUT ROWID")
         self.db_setup(sql_stmt)
+        self.account_setup()
+        self.items_setup()
+        self.rollup_setup(has_restaurant=False)
+        if self.incremental:
+            self.load_high_water_mark()
         
     def get_details(self) -> None:
         print("Parsing orders...")
-        response = requests.get(url="https://api.dominos.co.in/order-service/ve1/orders?userid={}".format(self.headers["userid"]), headers=self.headers)
-        if response.status_code != 200:
-            raise Exception("Request failed, try later.")
-        json_data = response.json()
-        orders = json_data["orders"]
-        self.parse_orders(orders)
-        while "link" in json_data:
-            response = requests.get(url=self.url.format(json_data["link"]["href"]), headers=self.headers)
-            retry = 2
-            while response.status_code != 200 and retry != 0:
-                time.sleep(self.sleep_dur[random.randint(0,2)])
-                response = requests.get(url=self.url.format(json_data["link"]["href"]), headers=self.headers)
-                retry -= 1
+        sess = self.user_session.get_session()
+        checkpoint = self.load_checkpoint()
+        self.open_dump(append=checkpoint is not None or self.incremental)
+        if checkpoint:
+            link, pages_done = checkpoint["cursor"], checkpoint["pages_done"]
+            new_orders = None
+            logging.info("Resuming after page {} from {}".format(pages_done, link))
+            # the pages left are older than the stored orders but were never crawled, so an incremental
+            # run must not stop at them nor leave them out of the dump; it pages on to the end
+            self.high_water_mark = None
+        else:
+            response = self.get_page(sess, self.url.format("order-service/ve1/orders?userid={}".format(self.headers["userid"])))
+            if response.status_code != 200:
+                raise Exception("Request failed, try later.")
+            page = self.page_orders(response, "orders", ["link.href"])
+            new_orders = self.parse_stream(page)
+            link = page.values.get("link.href")
+            pages_done = 1
+            self.save_checkpoint(link, pages_done, page.text)
+        while link:
+            if self.incremental and new_orders == 0:
+                logging.info("Reached already stored orders.")
+                break
+            response = self.get_page(sess, self.url.format(link))
             if response.status_code != 200:
                 raise Exception("Unable to complete request.")
-            json_data = response.json()
-            orders = json_data["orders"]
-            self.parse_orders(orders)
-            time.sleep(self.sleep_dur[random.randint(0,2)])
-        with open("dominos_data.json", "w") as f:
-            json.dump(self.json_arr, f)
-        self.user_session.logout()        
-
-    def parse_orders(self, orders: list) -> None:
-        db = Sqlite3DBHelper()
-        cur = db.get_cursor()
-        sql_stmt = ("INSERT OR IGNORE INTO "
-        "dominos_expense(order_id, cost, date, food_items) VALUES (?, ?, ?, ?)")
-        arr = [] 
-        for order in orders:
-            self.json_arr.append(order)
-            if "success" not in order["orderState"].lower():
-                order_id = order["orderId"]
-                msg = f"Skipping entry for orderid: {order_id}"
-                logging.info(msg)
-                continue
-            self.total_orders += 1
-            order_id = order["orderId"]
-            cost = float(order["netPrice"])
-            date = datetime.datetime.strptime(order["store"]["orderDate"] + " " + order["store"]["orderTime"], "%Y-%m-%d %H:%M:%S" ).isoformat()
-            food_items = []
-            for item in order["items"]:
-                food_items.append("{qty} x {name}".format(qty=item["quantity"], name=item["product"]["name"]))
-            arr.append((order_id, cost, date, ", ".join(food_items)))
-        cur.executemany(sql_stmt, arr)
-        db.commit()
-        db.close()
+            page = self.page_orders(response, "orders", ["link.href"])
+            new_orders = self.parse_stream(page)
+            link = page.values.get("link.href")
+            pages_done += 1
+            self.save_checkpoint(link, pages_done, page.text)
+        self.close_dump()
+        self.clear_checkpoint()
+        self.db.close()
+        self.user_session.finish()        
+
+    def parse_orders(self, orders: list, page_done: bool = True) -> int:
+        sql_stmt = self.insert_stmt(["order_id", "cost", "date", "food_items"])
+        arr, items, dates = self.parse_page(parsing.dominos_page, orders)
+        self.dump_orders(orders, dates)
+        self.total_orders += len(arr)
+        self.db.executemany(sql_stmt, arr)
+        self.insert_items(items)
+        if page_done:
+            self.db.page_done()
+        return self.count_new(dates)
 
     def set_default_headers(self,headers):
         with open("headers_dominos", "r") as f:
@@ -153,10 +177,17 @@ class DominosCalc(ExpenseCalc):
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser()
+    add_crawl_arguments(parser)
+    args = parser.parse_args()
     logging.basicConfig(level = logging.INFO)
     random.seed()
     logging.info("Starting...")
-    DominosCalc().get_details()
+    with instrumented(args):
+        # one session store and page cache for every account, the passphrase is asked for once
+        options = crawl_options(args)
+        for profile in args.profiles or [None]:
+            DominosCalc(**options, profile=profile).crawl()
     logging.info("Complete.")
 
 
@@ -0,0 +1,162 @@
+import time
+import random
+import logging
+import datetime
+import threading
+from email.utils import parsedate_to_datetime
+import requests
+from requests import Response
+from metrics import metrics
+
+
+class TokenBucket():
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        # returns the time spent waiting for a token
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def set_rate(self, rate: float) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.rate = rate
+
+
+class FetchConfig():
+    def __init__(self, start_rate: float = 0.25, min_rate: float = 0.05, max_rate: float = 2.0,
+                 increase: float = 0.05, decrease: float = 0.5, retries: int = 5,
+                 backoff: float = 2.0, max_backoff: float = 60.0, timeout: float = 30.0):
+        # rates are requests per second per worker, start_rate matches the old 3-5s sleeps
+        self.start_rate = start_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        # AIMD: every healthy response adds increase, every 429/5xx multiplies by decrease
+        self.increase = increase
+        self.decrease = decrease
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+
+fetch_configs = {
+    "swiggy": FetchConfig(),
+    "zomato": FetchConfig(max_rate=1.0),
+    "dominos": FetchConfig(),
+}
+
+
+def retry_after(response: Response) -> float:
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return 0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class Fetcher():
+    def __init__(self, config: FetchConfig, workers: int = 1, max_rate: float = None, name: str = None):
+        self.config = config
+        # provider label of the metrics
+        self.name = name
+        self.workers = workers
+        # an explicit --rate is a hard cap for the whole provider
+        self.max_rate = min(config.max_rate * workers, max_rate) if max_rate else config.max_rate * workers
+        self.min_rate = min(config.min_rate * workers, self.max_rate)
+        self.rate_limiter = TokenBucket(min(config.start_rate * workers, self.max_rate), workers)
+        self.lock = threading.Lock()
+
+    def is_retryable(self, response: Response) -> bool:
+        return response is None or response.status_code == 429 or response.status_code >= 500
+
+    def on_success(self) -> None:
+        with self.lock:
+            self.rate_limiter.set_rate(min(self.max_rate, self.rate_limiter.rate + self.config.increase * self.workers))
+
+    def on_throttled(self) -> None:
+        with self.lock:
+            rate = max(self.min_rate, self.rate_limiter.rate * self.config.decrease)
+            self.rate_limiter.set_rate(rate)
+        logging.info("Slowing down to {:.2f} requests/s".format(rate))
+
+    def backoff(self, attempt: int, response: Response) -> float:
+        # full jitter, unless the server asked for a longer wait
+        delay = random.uniform(0, min(self.config.max_backoff, self.config.backoff * 2 ** attempt))
+        return max(delay, retry_after(response))
+
+    def get(self, sess, url: str, headers: dict, retries: int = None, stream: bool = False, pages=None) -> Response:
+        if pages is not None:
+            # a page that goes into the page cache is read whole, a replayed one never reaches the network
+            return pages.get(lambda headers: self.fetch(sess, url, headers, retries), url, headers)
+        return self.fetch(sess, url, headers, retries, stream)
+
+    def fetch(self, sess, url: str, headers: dict, retries: int = None, stream: bool = False) -> Response:
+        retries = self.config.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            metrics.observe("rate_limit_wait_seconds", self.rate_limiter.acquire(), provider=self.name)
+            error = None
+            start = time.perf_counter()
+            try:
+                response = sess.get(url=url, headers=headers, timeout=self.config.timeout, stream=stream)
+            except requests.RequestException as e:
+                response, error = None, e
+            # with stream this is the time to the response headers, the body is timed by whoever reads it
+            metrics.observe("http_request_seconds", time.perf_counter() - start, provider=self.name)
+            metrics.count("http_requests_total", provider=self.name,
+                          status=response.status_code if response is not None else "error")
+            if response is not None and response.status_code in (200, 304):
+                self.on_success()
+                size = response.headers.get("Content-Length")
+                if size is None and not stream and response.status_code == 200:
+                    size = len(response.content)
+                if size is not None:
+                    metrics.count("http_response_bytes_total", int(size), provider=self.name)
+                return response
+            if not self.is_retryable(response):
+                return self.unstream(response)
+            self.on_throttled()
+            if attempt == retries:
+                break
+            if response is not None:
+                # hands a streamed connection back to the pool
+                response.close()
+            delay = self.backoff(attempt, response)
+            logging.warning("Request for {} failed ({}), retry {} of {} in {:.1f}s".format(
+                url, error or response.status_code, attempt + 1, retries, delay))
+            metrics.count("http_retries_total", provider=self.name)
+            metrics.observe("retry_backoff_seconds", delay, provider=self.name)
+            time.sleep(delay)
+        if error:
+            raise error
+        return self.unstream(response)
+
+    def unstream(self, response: Response) -> Response:
+        # an error reply is read whole, which hands a streamed connection back to the pool whether or not
+        # the caller looks at the body
+        response.content
+        return response
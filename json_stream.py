@@ -0,0 +1,86 @@
+import logging
+from requests import Response
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+scalar_events = ("string", "number", "boolean", "null")
+warned = False
+
+
+class OrderStream():
+    # the orders of one page, found at path ("data.orders", "entities.ORDER") in the response body.
+    # When streaming they are decoded one at a time while the body is still downloading, so only the
+    # orders not yet parsed are held in memory; the scalars at the given field paths are collected
+    # into values as they go by and are complete once the orders have been iterated
+    def __init__(self, response: Response, path: str, fields: list = (), stream: bool = False):
+        global warned
+        self.response = response
+        self.path = path
+        self.fields = set(fields)
+        self.values = {}
+        self.last = None
+        self.count = 0
+        if stream and ijson is None and not warned:
+            logging.warning("ijson is not installed, pip install ijson to stream pages, decoding whole pages instead")
+            warned = True
+        self.streaming = stream and ijson is not None
+        # the raw page is only kept when it was decoded in one go
+        self.text = None if self.streaming else response.text
+
+    def __iter__(self):
+        for order in self.iter_stream() if self.streaming else self.iter_loaded():
+            self.last = order
+            self.count += 1
+            yield order
+
+    def iter_loaded(self):
+        data = self.response.json()
+        for field in self.fields:
+            value = lookup(data, field)
+            if value is not None:
+                self.values[field] = value
+        orders = lookup(data, self.path) or []
+        yield from orders.values() if isinstance(orders, dict) else orders
+
+    def iter_stream(self):
+        raw = self.response.raw
+        # gzip and deflate bodies are decoded by urllib3 before ijson sees them
+        raw.decode_content = True
+        builder, depth, after_key = None, 0, False
+        item_prefix = self.path + ".item"
+        try:
+            for prefix, event, value in ijson.parse(raw, use_float=True):
+                if builder is not None:
+                    builder.event(event, value)
+                    if event in ("start_map", "start_array"):
+                        depth += 1
+                    elif event in ("end_map", "end_array"):
+                        depth -= 1
+                        if not depth:
+                            yield builder.value
+                            builder = None
+                    continue
+                # array items share one prefix, map values follow their key
+                starts_item = prefix == item_prefix or after_key
+                after_key = prefix == self.path and event == "map_key"
+                if starts_item:
+                    if event in ("start_map", "start_array"):
+                        builder, depth = ijson.ObjectBuilder(), 1
+                        builder.event(event, value)
+                    else:
+                        yield value
+                elif prefix in self.fields and event in scalar_events:
+                    self.values[prefix] = value
+        finally:
+            self.response.close()
+
+
+def lookup(data, path: str):
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
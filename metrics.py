@@ -0,0 +1,211 @@
+import json
+import time
+import logging
+import argparse
+import datetime
+import threading
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+
+
+# seconds, wide enough for both a parse of one page and a slow login
+buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Histogram():
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * len(buckets)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+
+
+class Metrics():
+    # counters and histograms keyed by name and labels (provider, status), shared by all threads of a run
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.started = datetime.datetime.now()
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, label_key(labels))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def total(self, name: str, **labels) -> float:
+        # a counter's value or a histogram's sum, added up over every label set that includes labels
+        wanted = set(label_key(labels))
+        with self.lock:
+            values = [value for (n, key), value in self.counters.items() if n == name and wanted <= set(key)]
+            values += [h.sum for (n, key), h in self.histograms.items() if n == name and wanted <= set(key)]
+        return sum(values)
+
+    def calls(self, name: str, **labels) -> int:
+        wanted = set(label_key(labels))
+        with self.lock:
+            return sum(h.count for (n, key), h in self.histograms.items() if n == name and wanted <= set(key))
+
+    def report(self) -> dict:
+        finished = datetime.datetime.now()
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), "count": h.count, "sum": round(h.sum, 6),
+                           "min": h.min, "max": h.max,
+                           "buckets": {str(bound): n for bound, n in zip(buckets, h.buckets)}}
+                          for (name, labels), h in sorted(self.histograms.items())]
+        return {"started": self.started.isoformat(), "finished": finished.isoformat(),
+                "elapsed_seconds": round((finished - self.started).total_seconds(), 3),
+                "counters": counters, "histograms": histograms}
+
+    def prometheus(self) -> str:
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE food_expense_{name} counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"food_expense_{name}{format_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE food_expense_{name} histogram")
+                for (n, labels), h in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    total = 0
+                    for bound, count in zip(buckets, h.buckets):
+                        total += count
+                        lines.append(f"food_expense_{name}_bucket{format_labels(labels + (('le', str(bound)),))} {total}")
+                    lines.append(f"food_expense_{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {h.count}")
+                    lines.append(f"food_expense_{name}_sum{format_labels(labels)} {h.sum}")
+                    lines.append(f"food_expense_{name}_count{format_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def phases(self) -> dict:
+        # seconds spent per provider in each timed phase
+        result = {}
+        with self.lock:
+            for (name, labels), h in self.histograms.items():
+                provider = dict(labels).get("provider", "all")
+                phase = name[:-len("_seconds")] if name.endswith("_seconds") else name
+                result.setdefault(provider, {})
+                result[provider][phase] = result[provider].get(phase, 0) + h.sum
+        return result
+
+
+def label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels) + "}"
+
+
+metrics = Metrics()
+
+
+class Profiler():
+    # cProfile only sees the thread that enabled it, every crawl thread gets its own profile and they are merged
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiles = []
+        self.enabled = False
+
+    @contextmanager
+    def thread(self):
+        if not self.enabled:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def dump(self, filename: str, top: int = 40) -> None:
+        if not self.profiles:
+            return
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(filename)
+        with open(filename + ".txt", "w") as f:
+            stats.stream = f
+            stats.sort_stats("cumulative").print_stats(top)
+            stats.sort_stats("tottime").print_stats(top)
+
+
+profiler = Profiler()
+
+
+def add_metrics_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--metrics", metavar="FILE", help="write a JSON run report with timings and counters")
+    parser.add_argument("--prometheus", metavar="FILE", help="write the run's metrics in Prometheus text format")
+    parser.add_argument("--cprofile", metavar="FILE", help="profile the run with cProfile, stats go to FILE and FILE.txt")
+    parser.add_argument("--tracemalloc", action="store_true", help="add the top memory allocation sites to the run report")
+
+
+@contextmanager
+def instrumented(args: argparse.Namespace):
+    # wraps a whole run: starts the opt-in profilers, then logs the phase totals and writes the reports
+    profiler.enabled = bool(args.cprofile)
+    if args.tracemalloc:
+        tracemalloc.start(10)
+    try:
+        with profiler.thread():
+            yield metrics
+    finally:
+        report = metrics.report()
+        if args.tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report["tracemalloc"] = {
+                "current_bytes": current, "peak_bytes": peak,
+                "top": [{"where": str(stat.traceback[0]), "bytes": stat.size, "blocks": stat.count}
+                        for stat in snapshot.statistics("lineno")[:25]],
+            }
+        for provider, phases in sorted(metrics.phases().items()):
+            logging.info("{}: {}".format(provider, ", ".join(
+                "{} {:.2f}s".format(phase, seconds) for phase, seconds in sorted(phases.items()))))
+        if args.metrics:
+            with open(args.metrics, "w") as f:
+                json.dump(report, f, indent=2)
+        if args.prometheus:
+            with open(args.prometheus, "w") as f:
+                f.write(metrics.prometheus())
+        if args.cprofile:
+            profiler.dump(args.cprofile)
@@ -0,0 +1,40 @@
+import gzip
+import json
+
+
+class OrderDumpWriter():
+    def __init__(self, filename: str, compress: bool = False, append: bool = False):
+        if compress and not filename.endswith(".gz"):
+            filename += ".gz"
+        self.filename = filename
+        mode = "at" if append else "wt"
+        if compress:
+            self.f = gzip.open(filename, mode, encoding="utf-8")
+        else:
+            self.f = open(filename, mode, encoding="utf-8")
+
+    def write(self, orders) -> None:
+        for order in orders:
+            self.f.write(json.dumps(order))
+            self.f.write("\n")
+        self.f.flush()
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def iter_orders(filename: str):
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt", encoding="utf-8") as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        if first == "[":
+            # dumps written before JSON Lines support are a single JSON array
+            yield from json.loads(first + f.read())
+            return
+        line = first + f.readline()
+        while line:
+            if line.strip():
+                yield json.loads(line)
+            line = f.readline()
@@ -0,0 +1,223 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+import argparse
+import requests
+from requests.structures import CaseInsensitiveDict
+from metrics import metrics
+
+
+# response headers kept with a page, the validators are sent back to ask whether it changed
+kept_headers = ("Content-Type", "ETag", "Last-Modified")
+
+
+class PageNotCached(requests.RequestException):
+    pass
+
+
+class CachedPage():
+    def __init__(self, meta: dict, body: bytes):
+        self.meta = meta
+        self.body = body
+
+    def validators(self) -> dict:
+        headers = {}
+        if self.meta["headers"].get("ETag"):
+            headers["If-None-Match"] = self.meta["headers"]["ETag"]
+        if self.meta["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = self.meta["headers"]["Last-Modified"]
+        return headers
+
+    def response(self, url: str) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = url
+        response.headers = CaseInsensitiveDict(self.meta["headers"])
+        response.encoding = self.meta.get("encoding")
+        response._content = self.body
+        return response
+
+
+class PageCache():
+    # raw order history pages on disk, one gzip file per provider, profile and URL. In record mode every
+    # page fetched is stored and sent with its ETag/Last-Modified the next time, a 304 is answered from
+    # the file. In replay mode pages only come from the files, the crawl needs no login and no network
+    def __init__(self, directory: str = "page_cache", mode: str = "record", max_age_days: float = 30,
+                 max_mb: float = 500):
+        self.directory = directory
+        self.mode = mode
+        self.max_age = max_age_days * 86400
+        self.max_bytes = max_mb * 2**20
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def scope(self, provider: str, profile: str = None) -> "ProviderPages":
+        return ProviderPages(self, os.path.join(self.directory, provider, profile or "default"), provider)
+
+    def entries(self) -> list:
+        # (mtime, size, path) of every stored page, the mtime is refreshed whenever a page is used
+        found = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".gz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return found
+
+    def evict(self) -> None:
+        # pages unused for max_age go first, then the least recently used until the cache fits in max_mb
+        entries = sorted(self.entries())
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        if removed:
+            metrics.count("page_cache_evicted_total", removed)
+            logging.info("Evicted {} pages from {}, {:.2f} MB left".format(removed, self.directory, total / 2**20))
+
+    def clear(self) -> None:
+        for _, _, path in self.entries():
+            os.remove(path)
+
+
+class ProviderPages():
+    # the pages of one provider login, the account file lets a replay use the account id of the recording
+    def __init__(self, cache: PageCache, directory: str, provider: str):
+        self.cache = cache
+        self.directory = directory
+        self.provider = provider
+
+    @property
+    def replaying(self) -> bool:
+        return self.cache.replaying
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + ".gz")
+
+    def load(self, url: str) -> CachedPage:
+        path = self.path(url)
+        try:
+            with gzip.open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError):
+            logging.warning("Ignoring damaged cached page {}".format(path))
+            return None
+        if meta.get("url") != url:
+            return None
+        return CachedPage(meta, body)
+
+    def store(self, url: str, response: requests.Response) -> None:
+        meta = {"url": url, "stored": int(time.time()), "encoding": response.encoding,
+                "headers": {k: response.headers[k] for k in kept_headers if k in response.headers}}
+        path = self.path(url)
+        os.makedirs(self.directory, exist_ok=True)
+        # written aside and renamed so a reader never sees half a page
+        tmp = "{}.{}.tmp".format(path, os.getpid())
+        with gzip.open(tmp, "wb", compresslevel=5) as f:
+            f.write(json.dumps(meta).encode() + b"\n")
+            f.write(response.content)
+        os.replace(tmp, path)
+        metrics.count("page_cache_stored_total", provider=self.provider)
+
+    def touch(self, url: str) -> None:
+        try:
+            os.utime(self.path(url))
+        except FileNotFoundError:
+            pass
+
+    def get(self, fetch, url: str, headers: dict) -> requests.Response:
+        # fetch(headers) sends the request, it is not called at all when replaying
+        cached = self.load(url)
+        if self.replaying:
+            if cached is None:
+                metrics.count("page_cache_misses_total", provider=self.provider)
+                raise PageNotCached("{} is not in {}".format(url, self.directory))
+            metrics.count("page_cache_hits_total", provider=self.provider)
+            self.touch(url)
+            return cached.response(url)
+        if cached is not None:
+            headers = dict(headers, **cached.validators())
+        response = fetch(headers)
+        if response.status_code == 304 and cached is not None:
+            metrics.count("page_cache_not_modified_total", provider=self.provider)
+            self.touch(url)
+            return cached.response(url)
+        if response.status_code == 200:
+            self.store(url, response)
+        return response
+
+    def save_account(self, account: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "account"), "w") as f:
+            f.write(account)
+
+    def account(self) -> str:
+        try:
+            with open(os.path.join(self.directory, "account")) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            raise RuntimeError("Nothing recorded in {}, crawl once with --page-cache record".format(self.directory))
+
+
+def add_page_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--page-cache", choices=["record", "replay"],
+                        help="record: keep the fetched pages and revalidate them next time, "
+                             "replay: crawl the recorded pages offline without logging in")
+    parser.add_argument("--page-cache-dir", default="page_cache", metavar="DIR", help="where the pages are kept")
+    parser.add_argument("--page-cache-days", type=float, default=30, help="pages unused for this long are evicted")
+    parser.add_argument("--page-cache-mb", type=float, default=500, help="size the page cache is kept under")
+
+
+def page_cache_from_args(args: argparse.Namespace) -> PageCache:
+    if not args.page_cache:
+        return None
+    return PageCache(args.page_cache_dir, args.page_cache, args.page_cache_days, args.page_cache_mb)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Show, trim or empty the recorded order history pages.")
+    parser.add_argument("--page-cache-dir", default="page_cache", metavar="DIR", help="where the pages are kept")
+    parser.add_argument("--days", type=float, default=30, help="evict pages unused for this long")
+    parser.add_argument("--mb", type=float, default=500, help="evict the least recently used pages above this size")
+    parser.add_argument("--evict", action="store_true")
+    parser.add_argument("--clear", action="store_true", help="remove every recorded page")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    cache = PageCache(args.page_cache_dir, max_age_days=args.days, max_mb=args.mb)
+    if args.clear:
+        cache.clear()
+    elif args.evict:
+        cache.evict()
+    sizes = {}
+    for _, size, path in cache.entries():
+        provider = os.path.relpath(os.path.dirname(path), cache.directory)
+        count, total = sizes.get(provider, (0, 0))
+        sizes[provider] = (count + 1, total + size)
+    for provider, (count, total) in sorted(sizes.items()):
+        print(f"{provider}: {count} pages, {total / 2**20:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import re
+import logging
+from datetime import datetime
+from functools import lru_cache
+from schema import epoch, paise
+
+
+# month names are matched here instead of through strptime's %B, which follows LC_TIME
+months = {name.lower(): number for number, name in enumerate(
+    ["January", "February", "March", "April", "May", "June", "July",
+     "August", "September", "October", "November", "December"], 1)}
+dish_pattern = re.compile(r"(\d+) x (.+?)(?=, \d+ x |$)")
+
+
+# dates come out as epoch seconds and money as paise, the way schema.py stores them
+
+def order_time(value: str) -> int:
+    # "%Y-%m-%d %H:%M:%S", fromisoformat is several times faster than strptime
+    if len(value) != 19 or value[10] != " ":
+        raise ValueError(f"time data {value!r} does not match format '%Y-%m-%d %H:%M:%S'")
+    return epoch(datetime.fromisoformat(value))
+
+
+@lru_cache(maxsize=4096)
+def zomato_day(value: str) -> int:
+    # "October 05, 2021", most orders share their day with others so days are cached
+    month, day, year = value.split(" ")
+    number = months.get(month.lower())
+    if number is None or not day.endswith(","):
+        raise ValueError(f"time data {value!r} does not match format '%B %d, %Y'")
+    return epoch(datetime(int(year), number, int(day[:-1])))
+
+
+@lru_cache(maxsize=4096)
+def zomato_time(value: str) -> int:
+    # "07:30 PM" as seconds into the day, there are only 1440 of them
+    clock, meridiem = value.split(" ")
+    hour, minute = clock.split(":")
+    hour, meridiem = int(hour), meridiem.upper()
+    if not 1 <= hour <= 12 or meridiem not in ("AM", "PM") or len(minute) != 2 or not 0 <= int(minute) <= 59:
+        raise ValueError(f"time data {value!r} does not match format '%I:%M %p'")
+    return (hour % 12 + (12 if meridiem == "PM" else 0)) * 3600 + int(minute) * 60
+
+
+def zomato_date(value: str) -> int:
+    # "%B %d, %Y at %I:%M %p"
+    day, sep, clock = value.partition(" at ")
+    if not sep:
+        raise ValueError(f"time data {value!r} does not match format '%B %d, %Y at %I:%M %p'")
+    return zomato_day(day) + zomato_time(clock)
+
+
+@lru_cache(maxsize=4096)
+def parse_cost(value) -> int:
+    # "₹1,234.50", "Rs. 99" or a plain number, in paise
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("Rs."):
+            value = value[3:]
+        value = value.lstrip("₹ \u00a0")
+        if "," in value:
+            value = value.replace(",", "")
+    return paise(value)
+
+
+def parse_price(value) -> int:
+    return parse_cost(value) if value is not None else None
+
+
+# each page parser makes one pass over a page of orders and returns
+# (expense rows ending with account, order_items rows, date of every order including skipped ones)
+
+def swiggy_page(orders: list, provider: str = "swiggy", account: str = None) -> tuple:
+    rows, items, dates = [], [], []
+    for order in orders:
+        date = order_time(order["order_time"])
+        dates.append(date)
+        order_id = order["order_id"]
+        if "delivered" not in order["order_status"].lower():
+            logging.info(f"Skipping entry for orderid: {order_id}, order_status: {order['order_status']}, "
+                         f"post_status: {order['post_status']}")
+            continue
+        food_items = []
+        for item_no, item in enumerate(order["order_items"]):
+            name, quantity = item["name"], item["quantity"]
+            food_items.append(f"{quantity} x {name}")
+            items.append((provider, order_id, item_no, name, int(quantity), parse_price(item.get("total"))))
+        rows.append((order_id, parse_cost(order["order_total_with_tip"]), date, order.get("restaurant_name", "NA"),
+                     ", ".join(food_items), order["post_status"], account))
+    return rows, items, dates
+
+
+def zomato_page(orders, provider: str = "zomato", account: str = None) -> tuple:
+    rows, items, dates = [], [], []
+    for order in orders:
+        date = zomato_date(order["orderDate"])
+        dates.append(date)
+        order_id = order["orderId"]
+        label = order["deliveryDetails"]["deliveryLabel"]
+        if "delivered" not in label.lower():
+            logging.info(f"Skipping entry for orderid: {order_id} with status: {label} ")
+            continue
+        food_items = order["dishString"]
+        # the order history only has the dish string, no per dish prices
+        for item_no, (quantity, name) in enumerate(dish_pattern.findall(food_items)):
+            items.append((provider, order_id, item_no, name, int(quantity), None))
+        rows.append((order_id, parse_cost(order["totalCost"]), date, order["resInfo"]["name"], food_items, account))
+    return rows, items, dates
+
+
+def dominos_page(orders: list, provider: str = "dominos", account: str = None) -> tuple:
+    rows, items, dates = [], [], []
+    for order in orders:
+        store = order["store"]
+        date = order_time(f"{store['orderDate']} {store['orderTime']}")
+        dates.append(date)
+        order_id = order["orderId"]
+        if "success" not in order["orderState"].lower():
+            logging.info(f"Skipping entry for orderid: {order_id}")
+            continue
+        food_items = []
+        for item_no, item in enumerate(order["items"]):
+            name, quantity = item["product"]["name"], item["quantity"]
+            food_items.append(f"{quantity} x {name}")
+            items.append((provider, order_id, item_no, name, int(quantity), parse_price(item.get("price"))))
+        rows.append((order_id, parse_cost(order["netPrice"]), date, ", ".join(food_items), account))
+    return rows, items, dates
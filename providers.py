@@ -0,0 +1,29 @@
+import importlib
+
+
+class Provider():
+    def __init__(self, name: str, label: str, table_name: str, module: str, calc: str, workers: int = 1):
+        self.name = name
+        self.label = label
+        self.table_name = table_name
+        self.module = module
+        self.calc = calc
+        # most pages the provider's pagination lets us fetch at once
+        self.workers = workers
+
+    def load(self) -> type:
+        # calculators pull in the HTTP stack, they are only imported when a crawl needs them
+        return getattr(importlib.import_module(self.module), self.calc)
+
+
+providers = {}
+
+
+def register_provider(name: str, label: str, table_name: str, module: str, calc: str, workers: int = 1) -> Provider:
+    providers[name] = Provider(name, label, table_name, module, calc, workers)
+    return providers[name]
+
+
+register_provider("zomato", "Zomato", "zomato_expense", "zomato_calc", "ZomatoCalc", workers=4)
+register_provider("swiggy", "Swiggy", "swiggy_expense", "swiggy_calc", "SwiggyCalc")
+register_provider("dominos", "Dominos", "dominos_expense", "dominos_calc", "DominosCalc")
@@ -0,0 +1,73 @@
+import os
+import glob
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from schema import default_account
+from providers import providers
+
+
+def find_dump(provider: str) -> str:
+    for filename in ("{}_data.jsonl", "{}_data.jsonl.gz", "{}_data.json"):
+        filename = filename.format(provider)
+        if os.path.exists(filename):
+            return filename
+    return None
+
+
+def find_dumps(provider: str) -> list:
+    # (account, filename), other accounts' dumps are named {provider}_{account}_data.jsonl
+    dumps = {}
+    filename = find_dump(provider)
+    if filename:
+        dumps[default_account] = filename
+    for filename in sorted(glob.glob(f"{provider}_*_data.jsonl")) + sorted(glob.glob(f"{provider}_*_data.jsonl.gz")):
+        account = os.path.basename(filename)[len(provider) + 1:].split("_data.jsonl")[0]
+        dumps.setdefault(account, filename)
+    return list(dumps.items())
+
+
+def ingest(provider: str, account: str, filename: str, rebuild: bool, page_size: int) -> tuple:
+    start = time.perf_counter()
+    # one transaction per 10 pages keeps the number of commits low without holding the lock for long
+    calc = providers[provider].load()(batch_pages=10, offline=True, account=account)
+    if rebuild:
+        calc.db.execute(f"DELETE FROM {calc.table_name} WHERE account = ?", (account,))
+        calc.db.commit()
+    count = calc.ingest_dump(filename, page_size)
+    return provider, account, count, time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild the expense tables from saved order dumps, no login needed.")
+    parser.add_argument("providers", nargs="*", help="providers to re-ingest ({}), all by default".format(", ".join(providers)))
+    parser.add_argument("--rebuild", action="store_true", help="delete existing rows before ingesting")
+    parser.add_argument("--parallel", action="store_true", help="ingest each provider in its own process")
+    parser.add_argument("--page-size", type=int, default=1000, help="orders parsed per batch")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    for provider in args.providers:
+        if provider not in providers:
+            parser.error(f"unknown provider {provider}")
+    jobs = []
+    for provider in args.providers or list(providers):
+        dumps = find_dumps(provider)
+        if not dumps:
+            print(f"No dump found for {provider}")
+        for account, filename in dumps:
+            jobs.append((provider, account, filename))
+    if args.parallel:
+        with ProcessPoolExecutor(max_workers=len(jobs) or 1) as pool:
+            futures = [pool.submit(ingest, *job, args.rebuild, args.page_size) for job in jobs]
+            results = [f.result() for f in futures]
+    else:
+        results = [ingest(*job, args.rebuild, args.page_size) for job in jobs]
+    for provider, account, count, elapsed in results:
+        label = provider if account == default_account else f"{provider} ({account})"
+        print(f"{label}: {count} orders re-ingested in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
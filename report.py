@@ -0,0 +1,123 @@
+import json
+import argparse
+from datetime import date
+from db import Sqlite3DBHelper, SummaryCache
+from providers import providers as registry
+
+
+periods = {
+    "day": "day",
+    "week": "strftime('%Y-W%W', day)",
+    "month": "substr(day, 1, 7)",
+    "year": "substr(day, 1, 4)",
+}
+
+
+def expense_report(start: date = None, end: date = None, group_by: str = None, by_restaurant: bool = False,
+                   by_provider: bool = True, providers: list = None, by_account: bool = False, accounts: list = None,
+                   use_cache: bool = True) -> list:
+    # answered from the daily_expense rollup, start and end days are inclusive
+    db = Sqlite3DBHelper()
+    cur = db.get_cursor()
+    cur.execute("select name FROM sqlite_master WHERE type='table' AND name='daily_expense'")
+    if not cur.fetchone():
+        db.close()
+        return []
+    query = [start and start.isoformat(), end and end.isoformat(), group_by, by_restaurant, by_provider,
+             sorted(providers or []), by_account, sorted(accounts or [])]
+    compute = lambda: rollup_query(cur, start, end, group_by, by_restaurant, by_provider, providers, by_account, accounts)
+    if use_cache:
+        rows = SummaryCache(db).cached("report:" + json.dumps(query), providers or list(registry), compute)
+    else:
+        rows = compute()
+    db.close()
+    return rows
+
+
+def rollup_query(cur, start: date, end: date, group_by: str, by_restaurant: bool, by_provider: bool, providers: list,
+                 by_account: bool, accounts: list) -> list:
+    columns = []
+    if by_provider:
+        columns.append("provider")
+    if by_account:
+        columns.append("account")
+    if group_by:
+        columns.append(f"{periods[group_by]} period")
+    if by_restaurant:
+        columns.append("restaurant_name")
+    where, params = [], []
+    if start:
+        where.append("day >= ?")
+        params.append(start.isoformat())
+    if end:
+        where.append("day <= ?")
+        params.append(end.isoformat())
+    if providers:
+        where.append("provider in ({})".format(", ".join("?" * len(providers))))
+        params.extend(providers)
+    if accounts:
+        where.append("account in ({})".format(", ".join("?" * len(accounts))))
+        params.extend(accounts)
+    sql_stmt = "select {}sum(order_count) order_count, sum(total_cost) / 100.0 total_cost from daily_expense".format(
+        "".join(column + ", " for column in columns))
+    if where:
+        sql_stmt += " where " + " and ".join(where)
+    if columns:
+        groups = ", ".join(str(i) for i in range(1, len(columns) + 1))
+        sql_stmt += f" group by {groups} order by {groups}"
+    cur.execute(sql_stmt, params)
+    return [dict(r) for r in cur.fetchall()]
+
+
+def dish_report(dish: str, by_provider: bool = True) -> list:
+    # full text match through order_items_fts when SQLite has FTS5, otherwise a LIKE over order_items
+    db = Sqlite3DBHelper()
+    cur = db.get_cursor()
+    cur.execute("select name FROM sqlite_master WHERE name in ('order_items', 'order_items_fts')")
+    existing = {r["name"] for r in cur.fetchall()}
+    if "order_items" not in existing:
+        db.close()
+        return []
+    if "order_items_fts" in existing:
+        where = "rowid in (select rowid from order_items_fts where order_items_fts match ?)"
+        param = '"{}"'.format(dish.replace('"', '""'))
+    else:
+        where = "name LIKE ?"
+        param = f"%{dish}%"
+    columns = "provider, name" if by_provider else "name"
+    cur.execute(
+        f"select {columns}, sum(quantity) quantity, count(distinct order_id) order_count, "
+        f"sum(price) / 100.0 total_price from order_items where {where} group by {columns} order by quantity desc",
+        (param,))
+    rows = [dict(r) for r in cur.fetchall()]
+    db.close()
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Expense report for any date window.")
+    parser.add_argument("--start", type=date.fromisoformat, help="first day, YYYY-MM-DD")
+    parser.add_argument("--end", type=date.fromisoformat, help="last day, YYYY-MM-DD")
+    parser.add_argument("--group-by", choices=list(periods))
+    parser.add_argument("--by-restaurant", action="store_true")
+    parser.add_argument("--combined", action="store_true", help="add up all providers")
+    parser.add_argument("--provider", action="append", dest="providers", help="limit to a provider, can be repeated")
+    parser.add_argument("--by-account", action="store_true", help="one line per account")
+    parser.add_argument("--account", action="append", dest="accounts", help="limit to an account, can be repeated")
+    parser.add_argument("--dish", help="report quantity and spend for dishes matching this name instead")
+    parser.add_argument("--no-cache", action="store_true", help="recompute instead of using a cached result")
+    args = parser.parse_args()
+    if args.dish:
+        rows = dish_report(args.dish, not args.combined)
+    else:
+        rows = expense_report(args.start, args.end, args.group_by, args.by_restaurant, not args.combined, args.providers,
+                              args.by_account, args.accounts, not args.no_cache)
+    if not rows:
+        print("No data")
+        return
+    for r in rows:
+        print("  ".join(str(v) for v in r.values()))
+
+
+if __name__ == "__main__":
+    main()
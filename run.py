@@ -0,0 +1,70 @@
+import time
+import random
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from common import add_crawl_arguments, crawl_options
+from providers import providers
+from metrics import instrumented, profiler
+
+
+def parse_rates(values: list) -> dict:
+    rates = {}
+    for value in values or []:
+        name, rate = value.split("=")
+        rates[name] = float(rate)
+    return rates
+
+
+def crawl(calc) -> tuple:
+    start = time.perf_counter()
+    with profiler.thread():
+        calc.crawl()
+    return "{} {}".format(calc.provider, calc.account), time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Log in to the selected providers, then crawl them all in parallel.")
+    parser.add_argument("providers", nargs="*", help="providers to crawl ({}), all by default".format(", ".join(providers)))
+    add_crawl_arguments(parser)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="pages fetched concurrently, for providers whose pagination allows it")
+    parser.add_argument("--provider-rate", action="append", metavar="NAME=RATE",
+                        help="requests per second for one provider, overrides --rate, can be repeated")
+    args = parser.parse_args()
+    for name in args.providers:
+        if name not in providers:
+            parser.error(f"unknown provider {name}")
+    logging.basicConfig(level = logging.INFO)
+    random.seed()
+    rates = parse_rates(args.provider_rate)
+    with instrumented(args):
+        calcs = []
+        base_options = crawl_options(args)
+        # every OTP prompt happens here, the crawls below run unattended
+        for name in args.providers or list(providers):
+            provider = providers[name]
+            options = dict(base_options)
+            options["rate"] = rates.get(name, args.rate)
+            fetcher = None
+            for profile in args.profiles or [None]:
+                logging.info("Logging in to {}{}...".format(provider.label, " as " + profile if profile else ""))
+                calc = provider.load()(**options, workers=min(args.workers, provider.workers), profile=profile)
+                # accounts of one provider crawl in parallel but share its rate limit
+                fetcher = fetcher or calc.fetcher
+                calc.fetcher = fetcher
+                calcs.append(calc)
+        logging.info("Starting...")
+        with ThreadPoolExecutor(max_workers=len(calcs)) as pool:
+            futures = [pool.submit(crawl, calc) for calc in calcs]
+            for future in futures:
+                try:
+                    name, elapsed = future.result()
+                    logging.info("{} complete in {:.1f}s".format(name, elapsed))
+                except Exception:
+                    logging.exception("Crawl failed")
+    logging.info("Complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import logging
+import argparse
+import datetime
+from providers import providers
+
+
+# rows stored before accounts were tracked, and crawls whose login gives no account id
+default_account = "default"
+
+# money is stored as integer paise and times as integer seconds since 1970 of the order's wall clock time
+# (the providers give no time zone, SQLite's 'unixepoch' reads them back as the same wall clock time)
+unix_epoch = datetime.datetime(1970, 1, 1)
+
+
+def paise(rupees) -> int:
+    return round(float(rupees) * 100)
+
+
+def rupees(paise: int) -> float:
+    return paise / 100 if paise is not None else None
+
+
+def epoch(when: datetime.datetime) -> int:
+    return (when - unix_epoch) // datetime.timedelta(seconds=1)
+
+
+def from_epoch(seconds: int) -> datetime.datetime:
+    return unix_epoch + datetime.timedelta(seconds=seconds)
+
+
+def rollup_select(provider: str, table_name: str, has_restaurant: bool) -> str:
+    # per account, day and restaurant totals of a provider table, as kept in daily_expense
+    restaurant = "coalesce(restaurant_name, 'NA')" if has_restaurant else "'{}'".format(provider.title())
+    return (f"select '{provider}', account, date(date, 'unixepoch'), {restaurant}, count(*), sum(cost) "
+            f"from {table_name} group by 2, 3, 4")
+
+
+daily_expense_table = (
+    "CREATE TABLE IF NOT EXISTS daily_expense(provider TEXT, account TEXT, day TEXT, restaurant_name TEXT, "
+    "order_count INTEGER, total_cost INTEGER, PRIMARY KEY(provider, account, day, restaurant_name)) WITHOUT ROWID")
+
+
+def bump_counter(provider: str) -> str:
+    # invalidates the cached summaries of the provider
+    return (f"INSERT INTO write_counter(provider, version) VALUES ('{provider}', 1) "
+            "ON CONFLICT(provider) DO UPDATE SET version = version + 1; ")
+
+
+def rollup_triggers(provider: str, table_name: str, has_restaurant: bool) -> list:
+    # keep daily_expense in step with every insert, delete and update of a provider table
+    restaurant = "coalesce({}.restaurant_name, 'NA')" if has_restaurant else "'{}'".format(provider.title())
+    add = (
+        "INSERT INTO daily_expense(provider, account, day, restaurant_name, order_count, total_cost) "
+        f"VALUES ('{provider}', new.account, date(new.date, 'unixepoch'), {restaurant.format('new')}, 1, new.cost) "
+        "ON CONFLICT(provider, account, day, restaurant_name) DO UPDATE SET "
+        "order_count = order_count + 1, total_cost = total_cost + excluded.total_cost; "
+    )
+    key = (f"provider = '{provider}' AND account = old.account AND day = date(old.date, 'unixepoch') "
+           f"AND restaurant_name = {restaurant.format('old')}")
+    remove = (
+        f"UPDATE daily_expense SET order_count = order_count - 1, total_cost = total_cost - old.cost WHERE {key}; "
+        f"DELETE FROM daily_expense WHERE {key} AND order_count <= 0; "
+    )
+    bump = bump_counter(provider)
+    columns = "account, date, cost" + (", restaurant_name" if has_restaurant else "")
+    return [f"DROP TRIGGER IF EXISTS {table_name}_rollup_{trigger}" for trigger in ("insert", "delete", "update")] + [
+        f"CREATE TRIGGER {table_name}_rollup_insert AFTER INSERT ON {table_name} BEGIN {add}{bump}END",
+        f"CREATE TRIGGER {table_name}_rollup_delete AFTER DELETE ON {table_name} BEGIN {remove}{bump}END",
+        f"CREATE TRIGGER {table_name}_rollup_update AFTER UPDATE OF {columns} ON {table_name} BEGIN {remove}{add}{bump}END",
+    ]
+
+
+def table_columns(con: sqlite3.Connection, table_name: str) -> list:
+    return [r[1] for r in con.execute(f"PRAGMA table_info({table_name})").fetchall()]
+
+
+def expense_tables(con: sqlite3.Connection) -> list:
+    # (provider, table name, columns) of the registered providers that have a table
+    tables = []
+    for provider in providers.values():
+        columns = table_columns(con, provider.table_name)
+        if columns:
+            tables.append((provider.name, provider.table_name, columns))
+    return tables
+
+
+def add_accounts(con: sqlite3.Connection) -> None:
+    # rows stored before accounts were tracked belong to the default account
+    for provider, table_name, columns in expense_tables(con):
+        if "account" not in columns:
+            con.execute(f"ALTER TABLE {table_name} ADD COLUMN account TEXT NOT NULL DEFAULT '{default_account}'")
+    columns = table_columns(con, "crawl_state")
+    if columns and "account" not in columns:
+        con.execute("ALTER TABLE crawl_state RENAME TO crawl_state_old")
+        con.execute("CREATE TABLE crawl_state(provider TEXT, account TEXT, cursor TEXT, pages_done INTEGER, "
+                    "payload TEXT, updated TEXT, PRIMARY KEY(provider, account))")
+        con.execute("INSERT INTO crawl_state select provider, ?, cursor, pages_done, payload, updated from crawl_state_old",
+                    (default_account,))
+        con.execute("DROP TABLE crawl_state_old")
+    columns = table_columns(con, "daily_expense")
+    if columns and "account" not in columns:
+        # the rollup triggers are recreated by each calc the next time it runs
+        drop_triggers(con, "%\\_rollup\\_%")
+        con.execute("CREATE TABLE daily_expense_new(provider TEXT, account TEXT, day TEXT, restaurant_name TEXT, "
+                    "order_count INTEGER, total_cost REAL, PRIMARY KEY(provider, account, day, restaurant_name)) WITHOUT ROWID")
+        con.execute("INSERT INTO daily_expense_new select provider, ?, day, restaurant_name, order_count, total_cost "
+                    "from daily_expense", (default_account,))
+        con.execute("DROP TABLE daily_expense")
+        con.execute("ALTER TABLE daily_expense_new RENAME TO daily_expense")
+
+
+def compact_storage(con: sqlite3.Connection) -> None:
+    # REAL rupees become INTEGER paise, ISO text times become INTEGER epoch seconds and the expense tables
+    # are clustered on order_id instead of a hidden rowid. The tables are rebuilt, which drops their triggers;
+    # every trigger is dropped up front so the renames do not trip over them, each calc creates its own again
+    drop_triggers(con, "%")
+    for provider, table_name, columns in expense_tables(con):
+        others = [c for c in columns if c not in ("order_id", "cost", "date", "account")]
+        con.execute(
+            f"CREATE TABLE {table_name}_new(order_id TEXT PRIMARY KEY, cost INTEGER, date INTEGER, "
+            + "".join(f"{c} TEXT, " for c in others)
+            + f"account TEXT NOT NULL DEFAULT '{default_account}') WITHOUT ROWID")
+        copied = "".join(f", {c}" for c in others)
+        con.execute(
+            f"INSERT INTO {table_name}_new(order_id, cost, date{copied}, account) "
+            f"select order_id, CAST(round(cost * 100) AS INTEGER), CAST(strftime('%s', date) AS INTEGER){copied}, account "
+            f"from {table_name} where order_id is not null")
+        con.execute(f"DROP TABLE {table_name}")
+        con.execute(f"ALTER TABLE {table_name}_new RENAME TO {table_name}")
+        con.execute(f"CREATE INDEX {table_name}_account_date ON {table_name}(account, date, cost)")
+    if table_columns(con, "order_items"):
+        # keeps its rowid, the full text index refers to it
+        con.execute(
+            "CREATE TABLE order_items_new(provider TEXT, order_id TEXT, item_no INTEGER, name TEXT, quantity INTEGER, "
+            "price INTEGER, UNIQUE(provider, order_id, item_no))")
+        con.execute(
+            "INSERT INTO order_items_new(rowid, provider, order_id, item_no, name, quantity, price) "
+            "select rowid, provider, order_id, item_no, name, quantity, CAST(round(price * 100) AS INTEGER) from order_items")
+        con.execute("DROP TABLE order_items")
+        con.execute("ALTER TABLE order_items_new RENAME TO order_items")
+        con.execute("CREATE INDEX order_items_name ON order_items(name COLLATE NOCASE)")
+        con.execute("CREATE INDEX order_items_order_id ON order_items(order_id)")
+    if table_columns(con, "daily_expense"):
+        con.execute("DROP TABLE daily_expense")
+        con.execute(daily_expense_table)
+        for provider, table_name, columns in expense_tables(con):
+            con.execute("INSERT INTO daily_expense " + rollup_select(provider, table_name, "restaurant_name" in columns))
+
+
+def summary_cache(con: sqlite3.Connection) -> None:
+    # cached report results and the per provider write counters that invalidate them. The rollup
+    # triggers are created here, now also bumping the counters, so no provider goes without them
+    con.execute("CREATE TABLE IF NOT EXISTS write_counter(provider TEXT PRIMARY KEY, version INTEGER NOT NULL) WITHOUT ROWID")
+    con.execute("CREATE TABLE IF NOT EXISTS summary_cache(key TEXT PRIMARY KEY, version TEXT, result TEXT, created INTEGER) "
+                "WITHOUT ROWID")
+    tables = expense_tables(con)
+    if tables and not table_columns(con, "daily_expense"):
+        con.execute(daily_expense_table)
+        for provider, table_name, columns in tables:
+            con.execute("INSERT INTO daily_expense " + rollup_select(provider, table_name, "restaurant_name" in columns))
+    for provider, table_name, columns in tables:
+        for sql_stmt in rollup_triggers(provider, table_name, "restaurant_name" in columns):
+            con.execute(sql_stmt)
+
+
+def drop_triggers(con: sqlite3.Connection, pattern: str) -> None:
+    names = con.execute("select name FROM sqlite_master WHERE type='trigger' AND name LIKE ? ESCAPE '\\'", (pattern,))
+    for (name,) in names.fetchall():
+        con.execute(f"DROP TRIGGER {name}")
+
+
+# migrations[n] takes a database from schema version n to n + 1, the version is kept in PRAGMA user_version
+migrations = [add_accounts, compact_storage, summary_cache]
+version = len(migrations)
+
+
+def schema_version(con: sqlite3.Connection) -> int:
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(con: sqlite3.Connection) -> None:
+    if schema_version(con) == version:
+        return
+    # the write lock is taken first so a second process waits and then finds the database upgraded
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        current = schema_version(con)
+        if current > version:
+            raise RuntimeError(f"food_expenses.db has schema version {current}, this code only knows up to {version}")
+        for number in range(current, version):
+            logging.info("Upgrading the database to schema version {} ({})".format(number + 1, migrations[number].__name__))
+            migrations[number](con)
+        con.execute(f"PRAGMA user_version = {version}")
+        con.commit()
+    except Exception:
+        con.rollback()
+        raise
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Upgrade food_expenses.db to the current schema version.")
+    parser.add_argument("--db", default="food_expenses.db")
+    parser.add_argument("--vacuum", action="store_true", help="rewrite the file afterwards to give the freed space back")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist")
+    size = os.path.getsize(args.db)
+    con = sqlite3.connect(args.db)
+    before = schema_version(con)
+    migrate(con)
+    if args.vacuum:
+        con.execute("VACUUM")
+    con.close()
+    print(f"Schema version {before} -> {version}, {size / 2**20:.1f} MB -> {os.path.getsize(args.db) / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import os
+import json
+import base64
+import getpass
+import hashlib
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+
+class SessionStore():
+    # logged in sessions (cookies, csrf/auth tokens) kept in a local file encrypted with a passphrase,
+    # read from FOOD_EXPENSE_SESSION_KEY or asked for once per run. Several runs may share the file, every
+    # change is made under a file lock to the sessions as they are on disk, not to those read at start
+    def __init__(self, filename: str = "sessions.enc", passphrase: str = None):
+        if Fernet is None:
+            raise RuntimeError("The session cache needs the cryptography package, pip install cryptography")
+        self.filename = filename
+        self.passphrase = passphrase or os.environ.get("FOOD_EXPENSE_SESSION_KEY") or getpass.getpass("Session cache passphrase: ")
+        self.lock = threading.Lock()
+        self.salt = None
+        self.keys = {}
+        with self.file_lock():
+            self.sessions = self.read()
+
+    def fernet(self) -> Fernet:
+        # the key derivation is slow on purpose, it is done once per salt
+        if self.salt not in self.keys:
+            key = hashlib.pbkdf2_hmac("sha256", self.passphrase.encode(), self.salt, 200000)
+            self.keys[self.salt] = Fernet(base64.urlsafe_b64encode(key))
+        return self.keys[self.salt]
+
+    @contextmanager
+    def file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.open(self.filename + ".lock", os.O_WRONLY | os.O_CREAT, 0o600), "wb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self) -> dict:
+        if not os.path.exists(self.filename):
+            self.salt = self.salt or os.urandom(16)
+            return {}
+        with open(self.filename, "rb") as f:
+            self.salt = f.read(16)
+            token = f.read()
+        try:
+            return json.loads(self.fernet().decrypt(token))
+        except InvalidToken:
+            raise RuntimeError("Unable to decrypt {}, wrong passphrase?".format(self.filename))
+
+    def write(self) -> None:
+        token = self.fernet().encrypt(json.dumps(self.sessions).encode())
+        tmp = "{}.{}.tmp".format(self.filename, os.getpid())
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(self.salt)
+            f.write(token)
+        os.replace(tmp, self.filename)
+
+    def get(self, provider: str) -> dict:
+        with self.lock:
+            return self.sessions.get(provider)
+
+    def save(self, provider: str, state: dict) -> None:
+        with self.lock, self.file_lock():
+            self.sessions = self.read()
+            self.sessions[provider] = state
+            self.write()
+
+    def clear(self, provider: str) -> None:
+        with self.lock, self.file_lock():
+            self.sessions = self.read()
+            if self.sessions.pop(provider, None) is not None:
+                self.write()
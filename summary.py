@@ -1,43 +1,94 @@
-from common import Sqlite3DBHelper
+import argparse
+from db import Sqlite3DBHelper, SummaryCache
+from providers import providers
+from schema import epoch, from_epoch, rupees
 from datetime import date, timedelta, datetime
 
 
-def do_calc():
+lockdown = (epoch(datetime(2020, 3, 25)), epoch(datetime(2021, 10, 1)))
+
+
+def print_expenses(label: str, r: dict) -> None:
+    print(f"{label} expenses")
+    print("-"*20)
+    total_cost = rupees(r["total_cost"])
+    total_orders = r["total_orders"]
+    start_date = from_epoch(r['start_date']).strftime("%d/%b/%Y")
+    end_date = from_epoch(r['end_date']).strftime("%d/%b/%Y")
+    print(f"Total orders placed from {start_date} to {end_date}: {total_orders}\n")
+    print(f"Total Expenses from {start_date} to {end_date}: Rs. {total_cost}\n")
+    print("Expenses from lockdown(25/Mar/2020) to 01/Oct/2021: Rs. %s\n" % rupees(r["lockdown_cost"]))
+    print("Expense for the last 30 days: Rs. %s\n" % rupees(r["last_30_cost"]))
+    print("Expense for the last 365 days: Rs. %s\n" % rupees(r["last_365_cost"]))
+    print("\n\n", end="")
+
+
+def combine(rows: list) -> dict:
+    combined = {k: sum(r[k] for r in rows) for k in ("total_cost", "total_orders", "lockdown_cost", "last_30_cost", "last_365_cost")}
+    combined["start_date"] = min(r["start_date"] for r in rows)
+    combined["end_date"] = max(r["end_date"] for r in rows)
+    return combined
+
+
+def window_start(today: date, days: int) -> int:
+    # the rolling windows start at midnight, so a day's figures are the same all day and can be cached
+    return epoch(datetime.combine(today - timedelta(days=days), datetime.min.time()))
+
+
+def provider_summary(cur, table_name: str, accounts: list, today: date) -> list:
+    last_30 = window_start(today, 30)
+    last_365 = window_start(today, 365)
+    where, params = "", [*lockdown, last_30, last_365]
+    if accounts:
+        where = "where account in ({})".format(", ".join("?" * len(accounts)))
+        params.extend(accounts)
+    # one pass per account over the (account, date, cost) index, every figure comes out of it
+    cur.execute(
+        "select account, sum(cost) total_cost, count(*) total_orders, min(date) start_date, max(date) end_date, "
+        "sum(case when date >= ? and date <= ? then cost else 0 end) lockdown_cost, "
+        "sum(case when date >= ? then cost else 0 end) last_30_cost, "
+        f"sum(case when date >= ? then cost else 0 end) last_365_cost from {table_name} {where} group by 1 order by 1",
+        params)
+    return [dict(r) for r in cur.fetchall()]
+
+
+def summaries(accounts: list = None, use_cache: bool = True) -> dict:
+    # {provider label: one row per account}, figures in paise and dates in epoch seconds
     db = Sqlite3DBHelper()
     cur = db.get_cursor()
-    tables = {"Zomato": "zomato_expense", "Swiggy": "swiggy_expense", "Dominos": "dominos_expense"}
-    for label, table_name in tables.items():
-        cur.execute("select name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
-        if cur.fetchone():
-            print(f"{label} expenses")
-            print("-"*20)
-            cur.execute(f"select sum(cost) total_cost from {table_name}")
-            r = cur.fetchone()
-            total_cost = round(r["total_cost"], 2)
-            cur.execute(f"select count(*) total_orders from {table_name}")
-            r = cur.fetchone()
-            total_orders = r["total_orders"]
-            cur.execute(f"select min(date) start_date, max(date) end_date from {table_name}")
-            r = cur.fetchone()
-            start_date = datetime.fromisoformat(r['start_date']).strftime("%d/%b/%Y")
-            end_date = datetime.fromisoformat(r['end_date']).strftime("%d/%b/%Y")
-            print(f"Total orders placed from {start_date} to {end_date}: {total_orders}\n")
-            print(f"Total Expenses from {start_date} to {end_date}: Rs. {total_cost}\n")
-            cur.execute(f"select sum(cost) cost from {table_name} where date >=  '2020-03-25T00:00:00' and date <= '2021-10-01T00:00:00'")
-            r = cur.fetchone()
-            print("Expenses from lockdown(25/Mar/2020) to 01/Oct/2021: Rs. %s\n" % round(r["cost"], 2))
-            param = datetime.now() - timedelta(days=30)
-            cur.execute(f"select sum(cost) cost from {table_name} where date>= ?", (param.isoformat(),))
-            r = cur.fetchone()
-            print("Expense for the last 30 days: Rs. %s\n" % round(r["cost"], 2))
-            param = datetime.now() - timedelta(days=365)
-            cur.execute(f"select sum(cost) cost from {table_name} where date >= ?", (param.isoformat(),))
-            r = cur.fetchone()
-            print("Expense for the last 365 days: Rs. %s\n" % round(r["cost"], 2))
-            print("\n\n", end="")
+    cache = SummaryCache(db)
+    today = date.today()
+    result = {}
+    for provider in providers.values():
+        cur.execute("select name FROM sqlite_master WHERE type='table' AND name=?", (provider.table_name,))
+        if not cur.fetchone():
+            result[provider.label] = []
+            continue
+        compute = lambda: provider_summary(cur, provider.table_name, accounts, today)
+        if use_cache:
+            key = "summary:{}:{}:{}".format(provider.name, ",".join(sorted(accounts or [])), today.isoformat())
+            result[provider.label] = cache.cached(key, [provider.name], compute)
         else:
+            result[provider.label] = compute()
+    db.close()
+    return result
+
+
+def do_calc(accounts: list = None, use_cache: bool = True):
+    for label, rows in summaries(accounts, use_cache).items():
+        if not rows:
             print(f"No data for {label}")
+            continue
+        if len(rows) > 1:
+            for r in rows:
+                print_expenses(f"{label} ({r['account']})", r)
+            label = f"{label} combined"
+        print_expenses(label, combine(rows))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--account", action="append", dest="accounts", help="only this account, can be repeated")
+    parser.add_argument("--no-cache", action="store_true", help="recompute instead of using the cached figures")
+    args = parser.parse_args()
     print("\n")
-    do_calc()
\ No newline at end of file
+    do_calc(args.accounts, not args.no_cache)
@@ -1,15 +1,20 @@
-import json
+import argparse
 import logging
-import requests
-import datetime
-import time
 import random
-from common import ExpenseCalc, Sqlite3DBHelper, UserSession
+import parsing
+from common import ExpenseCalc, UserSession, add_crawl_arguments, crawl_options
+from session_store import SessionStore
+from transport import Transport
+from metrics import instrumented
 
 
 class SwiggyUserSession(UserSession):
-    def __init__(self, filename: str):
-        super().__init__(filename)
+    provider = "swiggy"
+    state_attrs = ["csrf", "mobile"]
+
+    def __init__(self, filename: str, profile: str = None, transport: Transport = None):
+        super().__init__(filename, profile, transport)
+        self.mobile = None
     
     def set_cred(self, reply):
         pass
@@ -20,7 +25,7 @@ class SwiggyUserSession(UserSession):
 
     def doauth(self) -> dict:
         self.build_header()
-        self.sess = requests.Session()
+        self.sess = self.new_session()
         reply = self.sess.get("https://www.swiggy.com/dapi/cart", headers=self.headers)
         if reply.status_code != 200:
             raise Exception(reply.text)
@@ -30,6 +35,7 @@ class SwiggyUserSession(UserSession):
             ch = input("Continue Y/y or N/n ? ")
             if ch.lower() == 'y':
                 break
+        self.mobile = mob_num
         payload = f'{{"mobile": "{mob_num}","_csrf":"{self.csrf}"}}'
         reply = self.sess.post("https://www.swiggy.com/dapi/auth/sms-otp", headers=self.headers, data=payload)
         self.has_failed(reply)
@@ -50,6 +56,19 @@ class SwiggyUserSession(UserSession):
         if reply.status_code == 200 and reply.json().get("statusCode") != 0:
             raise Exception(reply.text) 
 
+    def get_account(self) -> str:
+        return self.mobile
+
+    def restore_account(self, account: str) -> None:
+        self.mobile = account
+
+    def validate(self) -> bool:
+        reply = self.sess.get("https://www.swiggy.com/dapi/order/all?order_id=", headers=self.headers)
+        if reply.status_code != 200 or reply.json().get("statusCode") != 0:
+            return False
+        self.csrf = reply.json().get('csrfToken')
+        return True
+
     def logout(self):
         payload = '{{"_csrf":"{}"}}'.format(self.csrf)
         reply = self.sess.post("https://www.swiggy.com/dapi/auth/logout", headers=self.headers, data=payload)
@@ -60,82 +79,95 @@ class SwiggyUserSession(UserSession):
 
 
 class SwiggyCalc(ExpenseCalc):
-    def __init__(self):
-        self.json_arr = []
-        self.url = 'https://www.swiggy.com/dapi/order/all?order_id={}'
-        self.user_session = SwiggyUserSession("swiggy_header")
-        self.headers = self.user_session.doauth()
+    provider = "swiggy"
+    table_name = "swiggy_expense"
+    base_url = "https://www.swiggy.com"
+
+    def __init__(self, offline: bool = False, session_store: SessionStore = None, **kwargs):
+        super().__init__(**kwargs)
+        self.url = self.base_url + '/dapi/order/all?order_id={}'
+        if not offline:
+            self.user_session = SwiggyUserSession("swiggy_header", self.profile, self.transport)
+            self.headers = self.user_session.login(session_store, self.pages)
+            self.set_account(self.user_session.get_account())
         sql_stmt = (
             "CREATE TABLE IF NOT EXISTS "
-            "swiggy_expense(order_id TEXT UNIQUE, cost REAL, date TEXT, "
-            "restaurant_name TEXT, food_items TEXT, post_status TEXT);"
+            "swiggy_expense(order_id TEXT PRIMARY KEY, cost INTEGER, date INTEGER, "
+            "restaurant_name TEXT, food_items TEXT, post_status TEXT, account TEXT NOT NULL DEFAULT 'default') WITHOUT ROWID;"
         )
         self.db_setup(sql_stmt)
+        self.account_setup()
+        self.items_setup()
+        self.rollup_setup()
+        if self.incremental:
+            self.load_high_water_mark()
 
     def get_details(self) -> None:
         print("Parsing orders...")
         sess = self.user_session.get_session()
-        response = sess.get(url=self.url.format(""), headers=self.headers)
-        if response.status_code != 200:
-            raise Exception("Request failed, try later.")
-        json_data = response.json()
-        self.total_orders = int(json_data["data"]["total_orders"])
-        logging.info("Total Orders {}".format(self.total_orders))
-        orders = json_data["data"]["orders"]
-        self.parse_orders(orders)
+        checkpoint = self.load_checkpoint()
+        self.open_dump(append=checkpoint is not None or self.incremental)
+        if checkpoint:
+            cursor, pages_done = checkpoint["cursor"], checkpoint["pages_done"]
+            new_orders = None
+            logging.info("Resuming after page {} from order_id {}".format(pages_done, cursor))
+            # the pages left are older than the stored orders but were never crawled, so an incremental
+            # run must not stop at them nor leave them out of the dump; it pages on to the end
+            self.high_water_mark = None
+        else:
+            response = self.get_page(sess, self.url.format(""))
+            if response.status_code != 200:
+                raise Exception("Request failed, try later.")
+            page = self.page_orders(response, "data.orders", ["data.total_orders"])
+            new_orders = self.parse_stream(page)
+            self.total_orders = int(page.values.get("data.total_orders", 0))
+            logging.info("Total Orders {}".format(self.total_orders))
+            cursor = page.last["order_id"] if page.last else None
+            pages_done = 1
+            self.save_checkpoint(cursor, pages_done, page.text)
         while True:
-            if not orders:
+            if not cursor:
                 logging.info("Orders array empty.")
                 break
-            response = sess.get(url=self.url.format(orders[-1]["order_id"]), headers=self.headers)
-            retry = 2
-            while response.status_code != 200 and retry != 0:
-                time.sleep(self.sleep_dur[random.randint(0,2)])
-                response = sess.get(url=self.url.format(orders[-1]["order_id"]), headers=self.headers)
-                retry -= 1
+            if self.incremental and new_orders == 0:
+                logging.info("Reached already stored orders.")
+                break
+            response = self.get_page(sess, self.url.format(cursor))
             if response.status_code != 200:
                 raise Exception("Unable to complete request for page.")
-            json_data = response.json()
-            orders = json_data["data"]["orders"]
-            self.parse_orders(orders)
-            time.sleep(self.sleep_dur[random.randint(0,2)])
-        with open("swiggy_data.json", "w") as f:
-            json.dump(self.json_arr, f)
-        self.user_session.logout()
-
-    def parse_orders(self, orders: list) -> None:
-        db = Sqlite3DBHelper()
-        cur = db.get_cursor()
-        sql_stmt = ("INSERT OR IGNORE "
-        "INTO swiggy_expense(order_id, cost, date, restaurant_name, food_items, post_status) VALUES (?, ?, ?, ?, ?, ?)")
-        arr = [] 
-        for order in orders:
-            self.json_arr.append(order)
-            if "delivered" not in order["order_status"].lower():
-                order_id = order["order_id"]
-                order_status = order["order_status"]
-                post_status = order["post_status"]
-                msg = f"Skipping entry for orderid: {order_id}, order_status: {order_status}, post_status: {post_status}"
-                logging.info(msg)
-                continue
-            order_id = order["order_id"]
-            cost = float(order["order_total_with_tip"])
-            date = datetime.datetime.strptime(order["order_time"], "%Y-%m-%d %H:%M:%S").isoformat()
-            restaurant_name = order.get("restaurant_name", "NA")
-            food_items = []
-            for order_items in order["order_items"]:
-                food_items.append("{qty} x {name}".format(qty=order_items["quantity"], name=order_items["name"]))
-            arr.append((order_id, cost, date, restaurant_name, ", ".join(food_items), order["post_status"]))
-        cur.executemany(sql_stmt, arr)
-        db.commit()
-        db.close()
+            page = self.page_orders(response, "data.orders")
+            new_orders = self.parse_stream(page)
+            cursor = page.last["order_id"] if page.last else None
+            pages_done += 1
+            self.save_checkpoint(cursor, pages_done, page.text)
+        self.close_dump()
+        self.clear_checkpoint()
+        self.db.close()
+        self.user_session.finish()
+
+    def parse_orders(self, orders: list, page_done: bool = True) -> int:
+        sql_stmt = self.insert_stmt(["order_id", "cost", "date", "restaurant_name", "food_items", "post_status"])
+        arr, items, dates = self.parse_page(parsing.swiggy_page, orders)
+        self.dump_orders(orders, dates)
+        self.db.executemany(sql_stmt, arr)
+        self.insert_items(items)
+        if page_done:
+            self.db.page_done()
+        return self.count_new(dates)
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser()
+    add_crawl_arguments(parser)
+    args = parser.parse_args()
     logging.basicConfig(level = logging.INFO)
     random.seed()
     logging.info("Starting...")
-    SwiggyCalc().get_details()
+    with instrumented(args):
+        # one session store and page cache for every account, the passphrase is asked for once
+        options = crawl_options(args)
+        for profile in args.profiles or [None]:
+            SwiggyCalc(**options, profile=profile).crawl()
     logging.info("Complete.")
 
 if __name__ == '__main__':
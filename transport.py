@@ -0,0 +1,169 @@
+import logging
+import http.client
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.cookies import extract_cookies_to_jar
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.util.request import ACCEPT_ENCODING
+from metrics import metrics
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+# the saved browser headers ask for br, which urllib3 only decodes with brotli installed
+accept_encoding = ACCEPT_ENCODING.replace(",", ", ")
+# connection specific headers are not allowed in HTTP/2
+hop_by_hop = ("connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade")
+
+
+class PooledAdapter(HTTPAdapter):
+    # keep-alive connections per host, sized for the fetch workers so a pool is never short of one. It does
+    # not block when it is: a connection that was never handed back is replaced instead of hanging the crawl
+    def __init__(self, pool_size: int):
+        super().__init__(pool_connections=4, pool_maxsize=pool_size)
+
+    def send(self, request, **kwargs):
+        request.headers["Accept-Encoding"] = accept_encoding
+        return super().send(request, **kwargs)
+
+    def stats(self) -> dict:
+        opened = sent = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        return {"requests": sent, "connections": opened}
+
+
+class Http2Adapter(BaseAdapter):
+    # sends the prepared requests of a requests.Session through an httpx client, so logins, cookies and the
+    # fetcher work the same over HTTP/2
+    def __init__(self, pool_size: int):
+        super().__init__()
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.client = httpx.Client(http2=True, limits=limits)
+        self.sent = 0
+        self.versions = {}
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in hop_by_hop}
+        headers["Accept-Encoding"] = accept_encoding
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        try:
+            reply = self.client.send(self.client.build_request(request.method, request.url, headers=headers,
+                                                               content=request.body, timeout=timeout), stream=True)
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(e, request=request)
+        except httpx.HTTPError as e:
+            raise requests.ConnectionError(e, request=request)
+        self.sent += 1
+        self.versions[reply.http_version] = self.versions.get(reply.http_version, 0) + 1
+        response = requests.Response()
+        response.status_code = reply.status_code
+        response.reason = reply.reason_phrase
+        response.headers = CaseInsensitiveDict(reply.headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.raw = BodyStream(reply)
+        extract_cookies_to_jar(response.cookies, request, response.raw)
+        if not stream:
+            response.content
+        return response
+
+    def close(self) -> None:
+        self.client.close()
+
+    def stats(self) -> dict:
+        return {"requests": self.sent, "versions": dict(self.versions)}
+
+
+class BodyStream():
+    # file-like body of an httpx response, decompressed as it is read, standing in for urllib3's in Response.raw
+    def __init__(self, reply):
+        self.reply = reply
+        self.chunks = reply.iter_bytes()
+        self.buffer = bytearray()
+        self.decode_content = True
+        # requests reads Set-Cookie headers from here
+        msg = http.client.HTTPMessage()
+        for k, v in reply.headers.multi_items():
+            msg[k] = v
+        self._original_response = self
+        self.msg = msg
+
+    def read(self, size: int = -1, **kwargs) -> bytes:
+        while size is None or size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.reply.close()
+                break
+            self.buffer += chunk
+        if size is None or size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self) -> None:
+        self.reply.close()
+
+
+class Transport():
+    # builds the requests sessions of one provider login: pooled keep-alive connections, decoded compressed
+    # bodies and, with http2, HTTP/2 for https
+    def __init__(self, pool_size: int = 1, http2: bool = False, name: str = None):
+        self.pool_size = max(1, pool_size)
+        self.http2 = http2
+        # provider label of the metrics
+        self.name = name
+        self.adapters = []
+        if http2 and httpx is None:
+            logging.warning("httpx is not installed, pip install httpx[http2] for HTTP/2, using HTTP/1.1 instead")
+            self.http2 = False
+
+    def session(self) -> requests.Session:
+        sess = requests.Session()
+        sess.mount("http://", self.adapter(PooledAdapter))
+        if self.http2:
+            try:
+                sess.mount("https://", self.adapter(Http2Adapter))
+                return sess
+            except ImportError:
+                logging.warning("h2 is not installed, pip install httpx[http2] for HTTP/2, using HTTP/1.1 instead")
+                self.http2 = False
+        sess.mount("https://", self.adapter(PooledAdapter))
+        return sess
+
+    def adapter(self, cls):
+        adapter = cls(self.pool_size)
+        self.adapters.append(adapter)
+        return adapter
+
+    def stats(self) -> dict:
+        result = {"requests": 0, "connections": 0, "http2_requests": 0}
+        for adapter in self.adapters:
+            stats = adapter.stats()
+            result["requests"] += stats["requests"]
+            result["connections"] += stats.get("connections", 0)
+            result["http2_requests"] += stats.get("versions", {}).get("HTTP/2", 0)
+        return result
+
+    def record(self) -> None:
+        stats = self.stats()
+        # HTTP/2 requests share the connections httpx keeps, they are not counted as opened or reused
+        reused = max(0, stats["requests"] - stats["http2_requests"] - stats["connections"])
+        metrics.count("http_connections_opened_total", stats["connections"], provider=self.name)
+        metrics.count("http_connections_reused_total", reused, provider=self.name)
+        message = "{}: {} requests, {} connections opened, {} reused".format(
+            self.name, stats["requests"], stats["connections"], reused)
+        if stats["http2_requests"]:
+            message += ", {} over HTTP/2".format(stats["http2_requests"])
+        logging.info(message)
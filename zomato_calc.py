@@ -1,16 +1,22 @@
-import json
+import argparse
 import logging
 import requests
-import datetime
-import locale
-import time
 import random
-from common import ExpenseCalc, Sqlite3DBHelper, UserSession
+import parsing
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests import Response
+from common import ExpenseCalc, UserSession, add_crawl_arguments, crawl_options
+from session_store import SessionStore
+from transport import Transport
+from metrics import instrumented
 
 
 class ZomatoUserSession(UserSession):
-    def __init__(self, filename: str):
-        super().__init__(filename)
+    provider = "zomato"
+    state_attrs = ["username"]
+
+    def __init__(self, filename: str, profile: str = None, transport: Transport = None):
+        super().__init__(filename, profile, transport)
     
     def set_cred(self, reply):
         self.headers["x-zomato-csrft"] = reply.json()["csrf"]
@@ -21,7 +27,7 @@ class ZomatoUserSession(UserSession):
 
     def doauth(self) -> dict:
         self.build_header()
-        self.sess = requests.Session()
+        self.sess = self.new_session()
         reply = self.sess.get("https://www.zomato.com/webroutes/auth/init", headers=self.headers)
         self.has_failed(reply)
         country_id = reply.json()["selected_country_code"]["countryId"]
@@ -49,7 +55,17 @@ class ZomatoUserSession(UserSession):
     
     def get_username(self):
         return self.username
+
+    def get_account(self) -> str:
+        return self.username
     
+    def restore_account(self, account: str) -> None:
+        self.username = account
+
+    def validate(self) -> bool:
+        reply = self.sess.get("https://www.zomato.com/webroutes/user/orders?page=1", headers=self.headers)
+        return reply.status_code == 200 and "SECTION_USER_ORDER_HISTORY" in reply.json().get("sections", {})
+
     def logout(self):
         reply = self.sess.get("https://www.zomato.com/webroutes/auth/logout", headers=self.headers)
         if reply.status_code != 200:
@@ -59,91 +75,121 @@ class ZomatoUserSession(UserSession):
 
 
 class ZomatoCalc(ExpenseCalc): 
-    def __init__(self):
-        self.url = 'https://www.zomato.com/webroutes/user/orders?page={}'
+    provider = "zomato"
+    table_name = "zomato_expense"
+    base_url = "https://www.zomato.com"
+
+    def __init__(self, offline: bool = False, session_store: SessionStore = None, **kwargs):
+        super().__init__(**kwargs)
+        self.url = self.base_url + '/webroutes/user/orders?page={}'
         self.failed_pages = []
-        self.json_arr = []
-        self.user_session = ZomatoUserSession("zomato_header")
-        self.headers = self.user_session.doauth()
-        self.headers['referer'] = 'https://www.zomato.com/{}/ordering'.format(self.user_session.get_username())
+        if not offline:
+            self.user_session = ZomatoUserSession("zomato_header", self.profile, self.transport)
+            self.headers = self.user_session.login(session_store, self.pages)
+            self.set_account(self.user_session.get_account())
+            self.headers['referer'] = 'https://www.zomato.com/{}/ordering'.format(self.user_session.get_username())
         sql_stmt = (
             "CREATE TABLE IF NOT EXISTS zomato_expense"
-            "(order_id TEXT UNIQUE, cost REAL, date TEXT, restaurant_name TEXT, food_items TEXT);"
+            "(order_id TEXT PRIMARY KEY, cost INTEGER, date INTEGER, restaurant_name TEXT, food_items TEXT, "
+            "account TEXT NOT NULL DEFAULT 'default') WITHOUT ROWID;"
         )
         self.db_setup(sql_stmt)
+        self.account_setup()
+        self.items_setup()
+        self.rollup_setup()
+        if self.incremental:
+            self.load_high_water_mark()
 
     def get_details(self) -> None:
         cur_page = 1
-        sess = self.user_session.get_session()
         print("Parsing orders...")
-        response = sess.get(url=self.url.format(cur_page), headers=self.headers)
+        self.open_dump(append=self.incremental)
+        response = self.fetch_page(cur_page)
         if response.status_code != 200:
             raise Exception("Request failed, please try later.")
-        json_data = response.json()
-        max_page_no = int(json_data["sections"]["SECTION_USER_ORDER_HISTORY"]["totalPages"])
+        page = self.page_orders(response, "entities.ORDER", ["sections.SECTION_USER_ORDER_HISTORY.totalPages"])
+        new_orders = self.parse_stream(page)
+        max_page_no = int(page.values["sections.SECTION_USER_ORDER_HISTORY.totalPages"])
         logging.info("Total pages to parse {}".format(max_page_no))
-        orders = json_data["entities"]["ORDER"]
-        self.parse_orders(orders)
-        cur_page += 1
-        while cur_page <= max_page_no:
-            response = sess.get(url=self.url.format(cur_page), headers=self.headers)
-            if response.status_code == 200:
-                json_data = response.json()
-                orders = json_data["entities"]["ORDER"]
-                self.parse_orders(orders)
-            else:
-                logging.warn("Unable to complete request for page {}".format(cur_page))
-                self.failed_pages.append(cur_page)
-            cur_page += 1
-            time.sleep(self.sleep_dur[random.randint(0,2)])
+        if self.incremental and not new_orders:
+            logging.info("Reached already stored orders.")
+        else:
+            self.crawl_pages(range(cur_page + 1, max_page_no + 1))
         if self.failed_pages:
             self.retry_pages()
-        with open("zomato_data.json", "w") as f:
-            json.dump(self.json_arr, f)
-        self.user_session.logout()
-    
-    def parse_orders(self, orders: dict) -> None:
-        db = Sqlite3DBHelper()
-        cur = db.get_cursor()
-        sql_stmt = ("INSERT OR IGNORE INTO "
-            "zomato_expense(order_id, cost, date, restaurant_name, food_items) VALUES (?, ?, ?, ?, ?)")
-        arr = [] 
-        for value in orders.values():
-            self.json_arr.append(value)
-            if "delivered" not in value["deliveryDetails"]["deliveryLabel"].lower():
-                msg = "Skipping entry for orderid: {} with status: {} ".format(value["orderId"], value["deliveryDetails"]["deliveryLabel"])
-                logging.info(msg)
-                continue
-            order_id = value["orderId"]
-            cost = float(value["totalCost"].replace('₹','').replace(',',''))
-            date = datetime.datetime.strptime(value["orderDate"], "%B %d, %Y at %I:%M %p").isoformat()
-            food_items = value["dishString"]
-            restaurant_name = value["resInfo"]["name"]
-            arr.append((order_id, cost, date, restaurant_name, food_items))
-        cur.executemany(sql_stmt, arr)
-        db.commit()
-        db.close()
+        self.close_dump()
+        self.db.close()
+        self.user_session.finish()
+
+    def fetch_page(self, page_no: int) -> Response:
+        return self.get_page(self.user_session.get_session(), self.url.format(page_no))
+
+    def crawl_pages(self, pages) -> None:
+        # pages are fetched by the worker pool, parsing and DB writes stay on this thread
+        pages = iter(pages)
+        stop = False
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {}
+            while True:
+                while not stop and len(pending) < self.workers:
+                    page_no = next(pages, None)
+                    if page_no is None:
+                        stop = True
+                        break
+                    pending[pool.submit(self.fetch_page, page_no)] = page_no
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page_no = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except requests.RequestException as e:
+                        logging.warn("Request for page {} failed: {}".format(page_no, e))
+                        response = None
+                    if response is not None and response.status_code == 200:
+                        new_orders = self.parse_stream(self.page_orders(response, "entities.ORDER"))
+                        if self.incremental and not new_orders and not stop:
+                            logging.info("Reached already stored orders.")
+                            stop = True
+                    else:
+                        if response is not None:
+                            response.close()
+                        logging.warn("Unable to complete request for page {}".format(page_no))
+                        self.failed_pages.append(page_no)
+
+    def parse_orders(self, orders: dict, page_done: bool = True) -> int:
+        sql_stmt = self.insert_stmt(["order_id", "cost", "date", "restaurant_name", "food_items"])
+        arr, items, dates = self.parse_page(parsing.zomato_page, orders.values())
+        self.dump_orders(orders.values(), dates)
+        self.db.executemany(sql_stmt, arr)
+        self.insert_items(items)
+        if page_done:
+            self.db.page_done()
+        return self.count_new(dates)
         
+    def dump_page(self, orders: list) -> dict:
+        return {str(value["orderId"]): value for value in orders}
+
     def retry_pages(self) -> None:
         logging.info("Retrying failed pages...")
-        sess = self.user_session.get_session()
-        for page_no in self.failed_pages:
-            response = sess.get(url=self.url.format(page_no), headers=self.headers)
-            if response.status_code == 200:
-                json_data = response.json()
-                orders = json_data["entities"]["ORDER"]
-                self.parse_orders(orders)
-            else:
-                logging.warn("Unable to complete request for page {}".format(page_no))
-            time.sleep(self.sleep_dur[random.randint(0,2)])
+        failed_pages, self.failed_pages = self.failed_pages, []
+        self.crawl_pages(failed_pages)
 
 
 def main() -> None:
+    parser = argparse.ArgumentParser()
+    add_crawl_arguments(parser)
+    parser.add_argument("--workers", type=int, default=1, help="number of pages fetched concurrently")
+    args = parser.parse_args()
     logging.basicConfig(level = logging.INFO)
-    locale.setlocale(locale.LC_TIME, "en_US")
     random.seed()
     logging.info("Starting...")
-    ZomatoCalc().get_details()
+    with instrumented(args):
+        # one session store and page cache for every account, the passphrase is asked for once
+        options = crawl_options(args)
+        for profile in args.profiles or [None]:
+            ZomatoCalc(**options, workers=args.workers, profile=profile).crawl()
     logging.info("Complete.")
 
 